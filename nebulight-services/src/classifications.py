@@ -0,0 +1,62 @@
+import os
+import pandas as pd
+
+REFERENCE_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reference-data')
+
+# Tickers carry no industry, so industries come from the exchange listings:
+# file, symbol column and industry column per market
+INDUSTRY_SOURCES = {
+    'US': [('nasdaq_instruments.csv', 'Symbol', 'Industry'), ('nyse_instruments.csv', 'Symbol', 'Industry')],
+    'UK': [('lse_instruments.csv', 'TIDM', 'ICB Super-Sector Name')],
+}
+
+_classifications = {}
+
+
+def load_sector_map(market):
+    """Sector name of every ticker of the market, from the database."""
+    try:
+        # Imported here so that local runs of named tickers work without a database
+        from sqlalchemy.orm import sessionmaker
+        from src.database import engine
+        from src.models import Sector, Ticker
+    except Exception as e:
+        print(f"No database for the {market} sectors: {e}")
+        return {}
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    exchange = 'NASDAQ' if market == 'US' else 'LSE'
+    try:
+        rows = (session.query(Ticker.ticker_symbol, Sector.name)
+                .join(Sector, Ticker.sector_id == Sector.id)
+                .filter(Ticker.exchange == exchange)
+                .all())
+        # update_sector.py files tickers Yahoo has no sector for under 'Unknown'
+        return {symbol: sector for symbol, sector in rows if sector and sector != 'Unknown'}
+    except Exception as e:
+        print(f"Error fetching sectors for {market}: {e}")
+        return {}
+    finally:
+        session.close()
+
+
+def load_industry_map(market):
+    """Industry name of every listed symbol of the market, from the reference data."""
+    industries = {}
+    for file_name, symbol_column, industry_column in INDUSTRY_SOURCES.get(market, []):
+        listing = pd.read_csv(os.path.join(REFERENCE_DATA_DIR, file_name), usecols=[symbol_column, industry_column])
+        listing = listing.dropna()
+        industries.update(zip(listing[symbol_column].str.strip(), listing[industry_column].str.strip()))
+    return industries
+
+
+def get_classifications(market):
+    """
+    Sector and industry of every known symbol of the market, as a DataFrame
+    indexed by symbol. Loaded once per process.
+    """
+    if market not in _classifications:
+        sectors = pd.Series(load_sector_map(market), name='sector', dtype=object)
+        industries = pd.Series(load_industry_map(market), name='industry', dtype=object)
+        _classifications[market] = pd.concat([sectors, industries], axis=1)
+    return _classifications[market]
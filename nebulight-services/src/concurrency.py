@@ -0,0 +1,46 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+YAHOO_HOST = 'query2.finance.yahoo.com'
+ALPHA_VANTAGE_HOST = 'www.alphavantage.co'
+
+# Maximum number of requests in flight per upstream host, across all threads of
+# the process. Override with HOST_CONCURRENCY="host=limit,host=limit".
+DEFAULT_HOST_CONCURRENCY = {
+    YAHOO_HOST: 4,
+    ALPHA_VANTAGE_HOST: 1,
+}
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def host_concurrency_limits():
+    limits = dict(DEFAULT_HOST_CONCURRENCY)
+    for entry in filter(None, os.getenv('HOST_CONCURRENCY', '').split(',')):
+        host, limit = entry.split('=')
+        limits[host.strip()] = int(limit)
+    return limits
+
+
+@contextmanager
+def host_slot(host):
+    """Blocks until fewer than the configured number of requests to host are in flight."""
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            limit = host_concurrency_limits().get(host, 1)
+            _host_semaphores[host] = threading.BoundedSemaphore(limit)
+        semaphore = _host_semaphores[host]
+    with semaphore:
+        yield
+
+
+def map_in_order(fn, items, max_workers):
+    """Runs fn over items on a thread pool and returns the results in submission order."""
+    if max_workers <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fn, item) for item in items]
+        return [future.result() for future in futures]
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import cached_property
+import numpy as np
+import pandas as pd
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from typing import Optional
+from .price_store import download_bars
+from .rate_limit import YAHOO, RateLimitExceeded, rate_limits
+from .trading_calendar import next_close, session_date
+
+router = APIRouter()
+# Mounted under the API prefix
+v1_router = APIRouter()
+
+# Months of daily closes per range a client can ask for
+HISTORY_RANGES = {'1mo': 1, '3mo': 3, '6mo': 6, '1y': 12}
+DEFAULT_RANGE = '3mo'
+# Symbols kept per process and range, least recently used evicted first
+HISTORY_CACHE_SIZE = int(os.getenv('HISTORY_CACHE_SIZE', 512))
+# Most symbols one bulk request may ask for
+HISTORY_MAX_SYMBOLS = int(os.getenv('HISTORY_MAX_SYMBOLS', 100))
+# Uncached symbols one request downloads, within Yahoo's burst so that it never
+# queues for budget; the others come back missing, uncacheable, to be asked again
+HISTORY_MAX_DOWNLOADS = int(os.getenv('HISTORY_MAX_DOWNLOADS', 5))
+# Longest a request waits for Yahoo budget before answering 503
+HISTORY_MAX_WAIT = float(os.getenv('HISTORY_MAX_WAIT', 2))
+# Yahoo keeps revising a session's bar for a while after the close
+HISTORY_SETTLE_MINUTES = int(os.getenv('HISTORY_SETTLE_MINUTES', 30))
+
+_history_cache = OrderedDict()
+_history_cache_lock = threading.Lock()
+
+
+def symbol_market(symbol):
+    """Market whose close makes a Yahoo symbol's history stale."""
+    return 'UK' if symbol.upper().endswith('.L') else 'US'
+
+
+def retry_after():
+    """Seconds until Yahoo's bucket holds a full request's downloads again."""
+    rate, _ = rate_limits()[YAHOO]
+    return str(math.ceil(HISTORY_MAX_DOWNLOADS / rate))
+
+
+def throttled(e):
+    return HTTPException(status_code=503, detail=f"Too many downloads, try again shortly: {e}",
+                         headers={'Retry-After': retry_after()})
+
+
+def etag(body):
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+
+def max_age(expires_at, now=None):
+    now = now or datetime.now(timezone.utc)
+    return max(0, int((expires_at - now).total_seconds()))
+
+
+def etag_matches(if_none_match, tag):
+    return bool(if_none_match) and tag in [candidate.strip() for candidate in if_none_match.split(',')]
+
+
+class History:
+    """Daily closes of a symbol over a range, oldest first, with their expiry."""
+
+    def __init__(self, symbol, history_range, dates, closes, expires_at):
+        self.symbol = symbol
+        self.range = history_range
+        self.dates = dates
+        self.closes = closes
+        self.expires_at = expires_at
+
+    @cached_property
+    def body(self):
+        """The /historical/{symbol} response, newest first."""
+        return json.dumps({'symbol': self.symbol, 'close_prices': [
+            {'date': date, 'close_price': close}
+            for date, close in zip(np.datetime_as_string(self.dates[::-1], unit='D').tolist(),
+                                   self.closes[::-1].tolist())
+        ]}).encode('utf-8')
+
+    @cached_property
+    def etag(self):
+        return etag(self.body)
+
+    def max_age(self, now=None):
+        return max_age(self.expires_at, now)
+
+
+def history_start(history_range, now=None):
+    months = HISTORY_RANGES[history_range]
+    return ((now or datetime.now(timezone.utc)) - pd.DateOffset(months=months)).strftime('%Y-%m-%d')
+
+
+def _to_history(symbol, history_range, bars, now=None):
+    """
+    Only bars of sessions that closed and settled are kept, never the candle of
+    one still trading, and the history expires once the next one has settled.
+    """
+    settle = timedelta(minutes=HISTORY_SETTLE_MINUTES)
+    settled_at = (now or datetime.now(timezone.utc)) - settle
+    market = symbol_market(symbol)
+    bars = bars.dropna(subset=['Close'])
+    dates = pd.DatetimeIndex(bars.index).tz_localize(None).values.astype('datetime64[D]')
+    closes = bars['Close'].to_numpy(dtype=np.float64)
+    settled = dates <= np.datetime64(session_date(market, settled_at))
+    return History(symbol, history_range, dates[settled], closes[settled], next_close(market, settled_at) + settle)
+
+
+def cached_history(symbol, history_range):
+    key = (symbol, history_range)
+    with _history_cache_lock:
+        history = _history_cache.get(key)
+        if history is None:
+            return None
+        if history.max_age() == 0:
+            del _history_cache[key]
+            return None
+        _history_cache.move_to_end(key)
+        return history
+
+
+def cache_history(history):
+    key = (history.symbol, history.range)
+    with _history_cache_lock:
+        _history_cache[key] = history
+        _history_cache.move_to_end(key)
+        while len(_history_cache) > HISTORY_CACHE_SIZE:
+            _history_cache.popitem(last=False)
+
+
+def normalize_symbol(symbol):
+    """Yahoo form of a requested symbol; yfinance only knows upper case ones."""
+    return symbol.strip().upper()
+
+
+def get_histories(symbols, history_range=DEFAULT_RANGE, errors=None):
+    """
+    Closes of each symbol over the range, downloaded once per session. Symbols
+    missing from the cache are fetched together, in one multi-symbol download.
+    Symbols Yahoo has no bars for are left out, and so are symbols whose
+    download failed, which go into errors when it is given. At most
+    HISTORY_MAX_DOWNLOADS symbols are downloaded; the rest are left out too.
+    Raises RateLimitExceeded when Yahoo's budget is not back within HISTORY_MAX_WAIT.
+    """
+    histories = {}
+    missing = []
+    for symbol in symbols:
+        history = cached_history(symbol, history_range)
+        if history is None:
+            missing.append(symbol)
+        else:
+            histories[symbol] = history
+    if missing:
+        # Symbols arrive in Yahoo form, which download_bars leaves alone for the US market
+        downloads = download_bars(missing[:HISTORY_MAX_DOWNLOADS], 'US', history_start(history_range), None,
+                                  errors, max_wait=HISTORY_MAX_WAIT)
+        for symbol, bars in downloads.items():
+            history = _to_history(symbol, history_range, bars)
+            cache_history(history)
+            histories[symbol] = history
+    return histories
+
+
+def get_history(symbol, history_range=DEFAULT_RANGE, errors=None):
+    return get_histories([symbol], history_range, errors).get(symbol)
+
+
+def columnar_body(histories, symbols, history_range):
+    """
+    One ascending dates array shared by all symbols and a close array per
+    symbol aligned to it, null where a symbol has no bar (e.g. a holiday on
+    its exchange only).
+    """
+    dates = np.unique(np.concatenate([history.dates for history in histories.values()])) \
+        if histories else np.empty(0, dtype='datetime64[D]')
+    closes = {}
+    for symbol in symbols:
+        if symbol not in histories:
+            continue
+        history = histories[symbol]
+        column = np.full(len(dates), np.nan)
+        column[np.searchsorted(dates, history.dates)] = history.closes
+        closes[symbol] = [None if math.isnan(close) else close for close in column.tolist()]
+    return json.dumps({
+        'range': history_range,
+        'dates': np.datetime_as_string(dates, unit='D').tolist(),
+        'closes': closes,
+        'missing': [symbol for symbol in symbols if symbol not in histories],
+    }).encode('utf-8')
+
+
+@router.get("/historical/{symbol}")
+def historical(symbol: str, if_none_match: Optional[str] = Header(None)):
+    symbol = normalize_symbol(symbol)
+    errors = {}
+    try:
+        history = get_history(symbol, errors=errors)
+    except RateLimitExceeded as e:
+        raise throttled(e)
+    except Exception as e:
+        return {"error": "Failed to fetch data", "message": str(e)}
+    if history is None and errors:
+        return {"error": "Failed to fetch data", "message": errors[symbol]}
+    if history is None:
+        return {"error": f"No data found for {symbol} since {history_start(DEFAULT_RANGE)}."}
+
+    # Valid until the market closes again, so clients and CDNs can revalidate cheaply
+    headers = {'ETag': history.etag, 'Cache-Control': f'public, max-age={history.max_age()}'}
+    if etag_matches(if_none_match, history.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=history.body, media_type='application/json', headers=headers)
+
+
+@v1_router.get("/historical")
+def bulk_historical(symbols: str, history_range: str = Query(DEFAULT_RANGE, alias='range'),
+                    if_none_match: Optional[str] = Header(None)):
+    symbols = list(dict.fromkeys(normalize_symbol(symbol) for symbol in symbols.split(',') if symbol.strip()))
+    if not symbols:
+        raise HTTPException(status_code=400, detail="No symbols given")
+    if len(symbols) > HISTORY_MAX_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"At most {HISTORY_MAX_SYMBOLS} symbols per request")
+    if history_range not in HISTORY_RANGES:
+        raise HTTPException(status_code=400, detail=f"range must be one of {', '.join(HISTORY_RANGES)}")
+
+    errors = {}
+    try:
+        histories = get_histories(symbols, history_range, errors)
+    except RateLimitExceeded as e:
+        raise throttled(e)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Failed to fetch data: {e}")
+    if errors and not histories:
+        raise HTTPException(status_code=502, detail=f"Failed to fetch data: {next(iter(errors.values()))}")
+
+    body = columnar_body(histories, symbols, history_range)
+    if len(histories) < len(symbols):
+        # A missing symbol may only have failed this time, so nobody should keep the answer
+        cache_control = 'no-store'
+    else:
+        # Stale as soon as the first of the markets involved closes again
+        expires_at = min(history.expires_at for history in histories.values())
+        cache_control = f'public, max-age={max_age(expires_at)}'
+    headers = {'ETag': etag(body), 'Cache-Control': cache_control}
+    if etag_matches(if_none_match, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
@@ -0,0 +1,153 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Emit a JSON line per span; the end-of-invocation summary is always emitted
+LOG_SPANS = os.getenv('INSTRUMENTATION_LOG_SPANS', 'true').lower() == 'true'
+# Slowest individual spans listed in the summary
+SUMMARY_SLOWEST = int(os.getenv('INSTRUMENTATION_SLOWEST', 10))
+
+_lock = threading.Lock()
+_local = threading.local()
+_invocation = {'stage': None, 'fields': {}, 'started_at': None, 'spans': []}
+
+
+class Span:
+    """A timed unit of work. Callers add byte and retry counts and extra fields while it runs."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.bytes = 0
+        self.retries = 0
+        self.error = None
+        self.started_at = time.time()
+        self.seconds = 0.0
+
+
+def _emit(record):
+    print(json.dumps(record, default=str))
+
+
+def _record(span):
+    with _lock:
+        # Outside an invocation, e.g. in the API, spans are only logged
+        if _invocation['stage'] is not None:
+            _invocation['spans'].append(span)
+    if LOG_SPANS:
+        record = {'event': 'span', 'stage': _invocation['stage'], 'span': span.name,
+                  'ms': round(span.seconds * 1000, 1)}
+        if span.bytes:
+            record['bytes'] = span.bytes
+        if span.retries:
+            record['retries'] = span.retries
+        if span.error:
+            record['error'] = span.error
+        record.update(span.fields)
+        _emit(record)
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    Times the enclosed block as a span named name, e.g. 'upstream.yahoo.download'.
+
+    Yields the Span so the block can set .bytes, .retries or further .fields.
+    An exception is recorded on the span and re-raised.
+    """
+    current = Span(name, fields)
+    parents = getattr(_local, 'parents', None)
+    if parents is None:
+        parents = _local.parents = []
+    if parents:
+        current.fields.setdefault('parent', parents[-1])
+    parents.append(name)
+    try:
+        yield current
+    except Exception as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        parents.pop()
+        current.seconds = time.time() - current.started_at
+        _record(current)
+
+
+def record(name, seconds, bytes=0, retries=0, **fields):
+    """Records a span that was timed by the caller."""
+    current = Span(name, fields)
+    current.seconds = seconds
+    current.bytes = bytes
+    current.retries = retries
+    _record(current)
+
+
+def start_invocation(stage, **fields):
+    """Starts collecting spans for one handler invocation, dropping those of a previous one."""
+    with _lock:
+        _invocation.update(stage=stage, fields=fields, started_at=time.time(), spans=[])
+
+
+def summarize(spans):
+    """Totals of spans by name, slowest name first."""
+    by_name = {}
+    for current in spans:
+        totals = by_name.setdefault(current.name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                                   'bytes': 0, 'retries': 0, 'errors': 0})
+        ms = current.seconds * 1000
+        totals['count'] += 1
+        totals['total_ms'] += ms
+        totals['max_ms'] = max(totals['max_ms'], ms)
+        totals['bytes'] += current.bytes
+        totals['retries'] += current.retries
+        totals['errors'] += 1 if current.error else 0
+    for totals in by_name.values():
+        totals['mean_ms'] = round(totals['total_ms'] / totals['count'], 1)
+        totals['total_ms'] = round(totals['total_ms'], 1)
+        totals['max_ms'] = round(totals['max_ms'], 1)
+    return dict(sorted(by_name.items(), key=lambda item: item[1]['total_ms'], reverse=True))
+
+
+def finish_invocation(**fields):
+    """Emits the summary of the current invocation as one JSON line and returns it."""
+    with _lock:
+        spans = _invocation['spans']
+        summary = {'event': 'summary', 'stage': _invocation['stage'], **_invocation['fields'], **fields,
+                   'wall_ms': round((time.time() - _invocation['started_at']) * 1000, 1)}
+        _invocation.update(stage=None, fields={}, started_at=None, spans=[])
+    summary['spans'] = summarize(spans)
+    summary['slowest'] = [
+        {'span': current.name, 'ms': round(current.seconds * 1000, 1), **current.fields}
+        for current in sorted(spans, key=lambda current: current.seconds, reverse=True)[:SUMMARY_SLOWEST]
+    ]
+    _emit(summary)
+    return summary
+
+
+def instrumented(stage):
+    """
+    Wraps a Lambda handler so its spans are collected per invocation and
+    summarized when it returns or fails. The summary reports how much of the
+    Lambda time budget was left.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            event = event or {}
+            start_invocation(stage, **{key: event[key] for key in ('market', 'run_id', 'batch_index') if key in event})
+            error = None
+            try:
+                return handler(event, context)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                fields = {'error': error} if error else {}
+                if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+                    fields['remaining_ms'] = context.get_remaining_time_in_millis()
+                finish_invocation(**fields)
+        return wrapper
+    return decorator
@@ -0,0 +1,50 @@
+import pandas as pd
+import yfinance as yf
+from io import BytesIO
+from src.concurrency import YAHOO_HOST, host_slot
+from src.instrumentation import span
+from src.object_store import get_cache_store, write_parquet
+from src.rate_limit import YAHOO, acquire
+
+# (index symbol, as-of date) -> OHLCV frame, shared by every ticker of a run
+_benchmark_histories = {}
+
+
+def get_benchmark_history(index_ticker, start_date, end_date):
+    """
+    Returns the index history between start_date and end_date, downloading it at
+    most once per as-of date. The frame is kept in process memory and, when a
+    cache backend is configured, persisted so later invocations of the same
+    Step Functions execution reuse it.
+    """
+    as_of = end_date.strftime('%Y-%m-%d')
+    cache_key = (index_ticker, as_of)
+    if cache_key in _benchmark_histories:
+        return _benchmark_histories[cache_key]
+
+    store = get_cache_store()
+    object_key = f'cache/benchmarks/{index_ticker}/{as_of}.parquet'
+    index_data = None
+
+    if store:
+        cached = store.get(object_key)
+        if cached is not None:
+            index_data = pd.read_parquet(BytesIO(cached))
+            # Only reuse a persisted series if it covers the requested window
+            if index_data.empty or index_data.index[0] > pd.Timestamp(start_date) + pd.Timedelta(days=7):
+                index_data = None
+
+    if index_data is None:
+        print(f"Downloading benchmark {index_ticker} as of {as_of}")
+        acquire(YAHOO)
+        with host_slot(YAHOO_HOST):
+            with span('upstream.yahoo.download', symbol=index_ticker):
+                index_data = yf.download(index_ticker, start=start_date.strftime(
+                    '%Y-%m-%d'), end=as_of, progress=False)
+        if store and not index_data.empty:
+            write_parquet(store, object_key, index_data)
+
+    # An empty download is a Yahoo hiccup; remembering it would fail every later batch
+    if not index_data.empty:
+        _benchmark_histories[cache_key] = index_data
+    return index_data
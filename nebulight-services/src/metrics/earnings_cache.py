@@ -0,0 +1,93 @@
+import json
+import os
+from datetime import datetime, timedelta
+from src.object_store import get_cache_store
+
+# Companies report roughly every quarter; the next report is expected this many
+# days after the latest reported one
+REPORT_INTERVAL_DAYS = 91
+# Upper bound on how long an entry is trusted, in case a report date slips
+EARNINGS_CACHE_TTL_DAYS = int(os.getenv('EARNINGS_CACHE_TTL_DAYS', 60))
+# Symbols without earnings (ETFs, funds) are checked again after this many days
+EMPTY_EARNINGS_TTL_DAYS = 7
+# A report that is late is looked for again after these many days, the last repeating
+OVERDUE_BACKOFF_DAYS = [3, 7, 14]
+
+_earnings_entries = {}
+
+
+def _object_key(symbol):
+    return f'cache/earnings/{symbol}.json'
+
+
+def next_expected_report_date(quarterly_earnings):
+    """Estimates the next report date from the latest reportedDate (or fiscalDateEnding)."""
+    if not quarterly_earnings:
+        return None
+    latest = quarterly_earnings[0]
+    reported = latest.get('reportedDate') or latest.get('fiscalDateEnding')
+    try:
+        return (datetime.fromisoformat(reported) + timedelta(days=REPORT_INTERVAL_DAYS)).date().isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def _latest_quarter(quarterly_earnings):
+    return quarterly_earnings[0].get('fiscalDateEnding') if quarterly_earnings else None
+
+
+def is_fresh(entry, today=None):
+    """An entry stays valid until the next report is due or its TTL expires, whichever is first."""
+    today = (today or datetime.today()).date()
+    fetched_at = datetime.fromisoformat(entry['fetched_at']).date()
+    ttl_days = EARNINGS_CACHE_TTL_DAYS if entry['quarterlyEarnings'] else EMPTY_EARNINGS_TTL_DAYS
+    if today >= fetched_at + timedelta(days=ttl_days):
+        return False
+    next_report = entry.get('next_report_date')
+    return next_report is None or today < datetime.fromisoformat(next_report).date()
+
+
+def get_cached_earnings(symbol):
+    """Returns the cached entry of symbol if it is still fresh, otherwise None."""
+    entry = _earnings_entries.get(symbol)
+    if entry is None:
+        store = get_cache_store()
+        body = store.get(_object_key(symbol)) if store else None
+        if body is not None:
+            entry = json.loads(body)
+            _earnings_entries[symbol] = entry
+    if entry is not None and is_fresh(entry):
+        return entry
+    return None
+
+
+def store_earnings(symbol, quarterly_earnings, trailing_eps):
+    """
+    Caches the quarterlyEarnings payload next to its precomputed trailing EPS.
+
+    When the report was due but the payload has no new quarter yet, the next
+    check is pushed back by OVERDUE_BACKOFF_DAYS instead of every run asking again.
+    """
+    today = datetime.today()
+    next_report_date = next_expected_report_date(quarterly_earnings)
+    overdue_checks = 0
+    previous = _earnings_entries.get(symbol)
+    due = previous.get('next_report_date') if previous else None
+    if (due and today.date() >= datetime.fromisoformat(due).date() and quarterly_earnings
+            and _latest_quarter(quarterly_earnings) == _latest_quarter(previous['quarterlyEarnings'])):
+        overdue_checks = previous.get('overdue_checks', 0) + 1
+        backoff = OVERDUE_BACKOFF_DAYS[min(overdue_checks, len(OVERDUE_BACKOFF_DAYS)) - 1]
+        next_report_date = (today + timedelta(days=backoff)).date().isoformat()
+    entry = {
+        'symbol': symbol,
+        'quarterlyEarnings': quarterly_earnings,
+        'trailing_eps': trailing_eps,
+        'next_report_date': next_report_date,
+        'overdue_checks': overdue_checks,
+        'fetched_at': today.isoformat(),
+    }
+    _earnings_entries[symbol] = entry
+    store = get_cache_store()
+    if store:
+        store.put(_object_key(symbol), json.dumps(entry).encode('utf-8'))
+    return entry
@@ -6,15 +6,24 @@ from dotenv import load_dotenv
 import os
 import requests
 import json
+import time
+from src.concurrency import ALPHA_VANTAGE_HOST, YAHOO_HOST, host_slot, map_in_order
+from src.instrumentation import span
+from src.metrics.earnings_cache import get_cached_earnings, store_earnings
+from src.rate_limit import ALPHA_VANTAGE, YAHOO, RateLimitExceeded, acquire
 load_dotenv()
 
 # Your Alpha Vantage API key
 ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
+# A hung earnings request must not hold the batch's only Alpha Vantage slot
+EARNINGS_REQUEST_TIMEOUT = 30
 
 def fetch_stock_price(symbol):
     stock = yf.Ticker(symbol)
-    price = stock.history(period="1d")['Close'].iloc[0]
-    history = stock.history(period="1d")
+    acquire(YAHOO)
+    with host_slot(YAHOO_HOST):
+        with span('upstream.yahoo.history', symbol=symbol):
+            history = stock.history(period="1d")
     if history.empty:
         print(f"No data fetched for {symbol}")
         return None
@@ -27,14 +36,33 @@ def fetch_stock_price(symbol):
 
 def fetch_quarterly_earnings(symbol):
     url = f'https://www.alphavantage.co/query?function=EARNINGS&symbol={symbol}&apikey={ALPHA_VANTAGE_API_KEY}'
-    response = requests.get(url)
+    # Raises RateLimitExceeded when no request fits within RATE_LIMIT_MAX_WAIT
+    acquire(ALPHA_VANTAGE)
+    with host_slot(ALPHA_VANTAGE_HOST):
+        try:
+            with span('upstream.alphavantage.earnings', symbol=symbol) as request:
+                response = requests.get(url, timeout=EARNINGS_REQUEST_TIMEOUT)
+                request.bytes = len(response.content)
+                request.fields['status'] = response.status_code
+        except requests.RequestException as e:
+            # Like a refusal, nothing is cached and the next run asks again
+            print(f"Error fetching earnings for {symbol}: {e}")
+            return None
     if response.status_code == 200:
-        data = response.json()
+        try:
+            data = response.json()
+        except ValueError as e:
+            print(f"Alpha Vantage sent no JSON for {symbol}: {e}")
+            return None
         if 'quarterlyEarnings' in data:
             return data['quarterlyEarnings']
+        elif 'Note' in data or 'Information' in data:
+            # Throttled or over quota, the symbol may well have earnings
+            print(f"Alpha Vantage refused earnings request for {symbol}: {data}")
+            return None
         else:
             print(f"No quarterly earnings data found for {symbol}")
-            return None
+            return []
     else:
         print(f"Error fetching data: {response.status_code}")
         return None
@@ -46,7 +74,6 @@ def calculate_trailing_eps(earnings_data):
     
     try:
         # Get the EPS values for the last four quarters
-        print(earnings_data[0])
         last_four_eps = [float(earnings_data[i]['reportedEPS']) for i in range(4)]
         # Calculate the trailing EPS
         trailing_eps = sum(last_four_eps)
@@ -55,10 +82,43 @@ def calculate_trailing_eps(earnings_data):
         print(f"Error calculating trailing EPS: {e}")
         return None
 
-def calculate_pe_ratio_ttm(symbol: str):
-    earnings_data = fetch_quarterly_earnings(symbol)
+def fetch_trailing_eps(symbol, budget=None):
+    """
+    Trailing EPS from the earnings cache, calling Alpha Vantage only once a new
+    report is due and, given a RequestBudget, only while it lasts.
+    """
+    try:
+        cached = get_cached_earnings(symbol)
+    except Exception as e:
+        # The cache is an optimisation; without it the symbol is fetched
+        print(f"Error reading cached earnings for {symbol}: {e}")
+        cached = None
+    if cached is not None:
+        return cached['trailing_eps']
+
+    if budget is not None and not budget.take():
+        return None
+    try:
+        earnings_data = fetch_quarterly_earnings(symbol)
+    except RateLimitExceeded as e:
+        print(f"Skipping earnings for {symbol}: {e}")
+        # Others share the bucket; later symbols would only wait in vain too
+        if budget is not None:
+            budget.exhaust()
+        return None
+    if earnings_data is None:
+        return None
     trailing_eps = calculate_trailing_eps(earnings_data)
-    stock_price = fetch_stock_price(symbol)
+    try:
+        store_earnings(symbol, earnings_data, trailing_eps)
+    except Exception as e:
+        print(f"Error caching earnings for {symbol}: {e}")
+    return trailing_eps
+
+def calculate_pe_ratio_ttm(symbol: str, stock_price=None):
+    trailing_eps = fetch_trailing_eps(symbol)
+    if stock_price is None:
+        stock_price = fetch_stock_price(symbol)
 
     if stock_price is None or trailing_eps is None or trailing_eps <= 0:
         print(f"{symbol}: Invalid data for P/E calculation")
@@ -71,10 +131,33 @@ def calculate_pe_ratio_ttm(symbol: str):
         print(f"{symbol}: Division by zero in P/E calculation")
         return None
 
-def calculate_financial_summary_metrics(stock_ticker):
+def calculate_financial_summary_metrics(stock_ticker, stock_price=None):
     financial_summary_metrics = {}   
-    financial_summary_metrics['pe_ratio_ttm'] = calculate_pe_ratio_ttm(stock_ticker)
+    financial_summary_metrics['pe_ratio_ttm'] = calculate_pe_ratio_ttm(stock_ticker, stock_price)
     return financial_summary_metrics
 
-res = calculate_financial_summary_metrics('BZFD')
-print(res)
\ No newline at end of file
+def calculate_financial_summary_metrics_batch(stock_prices, max_workers=1, budget=None, seconds=None):
+    """
+    Financial summary metrics for a batch of tickers whose closing prices are already loaded.
+
+    :param stock_prices: Series of latest closing prices indexed by symbol.
+    :param max_workers: Threads used to look up trailing EPS for symbols missing from the earnings cache.
+    :param budget: RequestBudget capping the Alpha Vantage calls; symbols beyond it get no P/E.
+    :param seconds: Optional dict receiving the time each symbol's lookup took, rate limit waits included.
+    :return: DataFrame indexed like stock_prices with one column per metric.
+    """
+    def timed_trailing_eps(symbol):
+        started_at = time.time()
+        try:
+            return fetch_trailing_eps(symbol, budget)
+        finally:
+            if seconds is not None:
+                seconds[symbol] = time.time() - started_at
+
+    with span('metrics.financial_summary', symbols=len(stock_prices)):
+        trailing_eps = pd.Series(map_in_order(timed_trailing_eps, list(stock_prices.index), max_workers),
+                                 index=stock_prices.index, dtype=float)
+        # P/E is undefined for non-positive earnings
+        positive_eps = trailing_eps.where(trailing_eps > 0)
+        return pd.DataFrame({'pe_ratio_ttm': stock_prices.astype(float) / positive_eps})
+
@@ -1,35 +1,69 @@
 import yfinance as yf
 from datetime import datetime, timedelta
+from src.concurrency import YAHOO_HOST, host_slot
+from src.instrumentation import span
+from src.metrics.benchmark_cache import get_benchmark_history
+from src.rate_limit import YAHOO, acquire
 
+# Longest calendar window any momentum metric looks at (12m relative strength
+# and the 52 week high). One download of this length serves every calculator.
+HISTORY_LOOKBACK_DAYS = 365
 
-def calculate_relative_strength(stock_ticker, index_ticker, periods):
-    end_date = datetime.today().strftime('%Y-%m-%d')
 
-    stock_data = yf.download(stock_ticker, end=end_date)
-    index_data = yf.download(index_ticker, end=end_date)
+class HistoryContext:
+    """OHLCV history for a ticker and its index, downloaded once and shared
+    by all the momentum calculators. Pass stock_data to reuse bars that were
+    already loaded, e.g. from the price store."""
+
+    def __init__(self, stock_ticker, index_ticker, end_date=None, stock_data=None):
+        self.stock_ticker = stock_ticker
+        self.index_ticker = index_ticker
+        self.end_date = end_date or datetime.today()
+        self.start_date = self.end_date - timedelta(days=HISTORY_LOOKBACK_DAYS)
+
+        if stock_data is None:
+            stock_data = self._download(stock_ticker)
+        self.stock_data = stock_data
+        self.index_data = get_benchmark_history(index_ticker, self.start_date, self.end_date)
+
+    def _download(self, ticker):
+        acquire(YAHOO)
+        with host_slot(YAHOO_HOST):
+            with span('upstream.yahoo.download', symbol=ticker):
+                return yf.download(ticker, start=self.start_date.strftime(
+                    '%Y-%m-%d'), end=self.end_date.strftime('%Y-%m-%d'), progress=False)
+
+
+def benchmark_ticker(exchange='Nasdaq'):
+    return '^GSPC' if exchange == 'Nasdaq' else 'ASX'
+
+
+def load_benchmark_history(index_ticker, end_date=None):
+    """Warms the benchmark cache so every ticker of the run shares one index download."""
+    end_date = end_date or datetime.today()
+    return get_benchmark_history(index_ticker, end_date - timedelta(days=HISTORY_LOOKBACK_DAYS), end_date)
+
+
+def trailing_window(data, days, end_date=None):
+    """Returns the rows of data that fall within the last `days` calendar days."""
+    end_date = end_date or datetime.today()
+    start_date = (end_date - timedelta(days=days)).strftime('%Y-%m-%d')
+    return data.loc[data.index >= start_date]
+
+
+def calculate_relative_strength(stock_data, index_data, periods, end_date=None):
+    period_days = {1: 30, 3: 90, 6: 180, 12: 365}
 
     results = {}
     for period in periods:
-        if period == 1:
-            start_date = (datetime.today() - timedelta(days=30)
-                          ).strftime('%Y-%m-%d')
-        elif period == 3:
-            start_date = (datetime.today() - timedelta(days=90)
-                          ).strftime('%Y-%m-%d')
-        elif period == 6:
-            start_date = (datetime.today() - timedelta(days=180)
-                          ).strftime('%Y-%m-%d')
-        elif period == 12:
-            start_date = (datetime.today() - timedelta(days=365)
-                          ).strftime('%Y-%m-%d')
+        stock_window = trailing_window(stock_data, period_days[period], end_date)
+        index_window = trailing_window(index_data, period_days[period], end_date)
 
         # Fetching the exact start prices
-        stock_start_price = stock_data.loc[stock_data.index >=
-                                           start_date].iloc[0]['Adj Close']
+        stock_start_price = stock_window.iloc[0]['Adj Close']
         stock_end_price = stock_data.iloc[-1]['Adj Close']
 
-        index_start_price = index_data.loc[index_data.index >=
-                                           start_date].iloc[0]['Adj Close']
+        index_start_price = index_window.iloc[0]['Adj Close']
         index_end_price = index_data.iloc[-1]['Adj Close']
 
         stock_change = stock_end_price / stock_start_price
@@ -41,16 +75,12 @@ def calculate_relative_strength(stock_ticker, index_ticker, periods):
     return results
 
 
-def calculate_volume_ratio_10d_3m(stock_ticker):
-    end_date = datetime.today()
-    start_date_3m = end_date - timedelta(days=90)  # Approximate 3 months
-
-    # Fetch stock data
-    stock_data = yf.download(stock_ticker, start=start_date_3m.strftime(
-        '%Y-%m-%d'), end=end_date.strftime('%Y-%m-%d'))
+def calculate_volume_ratio_10d_3m(stock_data, end_date=None):
+    # Approximate 3 months
+    stock_data = trailing_window(stock_data, 90, end_date)
 
     # Calculate average volume over the last 10 trading days
-    avg_volume_10d = stock_data['Volume'][-10:].mean()
+    avg_volume_10d = stock_data['Volume'].iloc[-10:].mean()
 
     # Calculate average volume over the last 3 months
     avg_volume_3m = stock_data['Volume'].mean()
@@ -61,35 +91,30 @@ def calculate_volume_ratio_10d_3m(stock_ticker):
     return volume_ratio_10d_3m
 
 
-def calculate_volume_ratio_1d_2d(stock_ticker):
-    end_date = datetime.today()
-    start_date = end_date - timedelta(days=10)  # Fetch last 10 days to ensure we have at least 2 trading days
-
-    stock_data = yf.download(stock_ticker, start=start_date.strftime('%Y-%m-%d'), end=end_date.strftime('%Y-%m-%d'))
+def calculate_volume_ratio_1d_2d(stock_data, end_date=None):
+    # Last 10 days to ensure we have at least 2 trading days
+    stock_data = trailing_window(stock_data, 10, end_date)
 
     # Ensure we have enough data
     if len(stock_data) < 2:
         raise ValueError("Not enough data to calculate volume surge")
-    
-    current_volume = stock_data['Volume'][-1]
-    previous_day_volume = stock_data['Volume'][-2]
+
+    current_volume = stock_data['Volume'].iloc[-1]
+    previous_day_volume = stock_data['Volume'].iloc[-2]
     volume_ratio_1d_2d = ((current_volume - previous_day_volume) / previous_day_volume) * 100
 
     return volume_ratio_1d_2d
 
-def calculate_price_vs_52_week_high(stock_ticker):
-    end_date = datetime.today()
-    start_date_52w = end_date - timedelta(days=365)  # 52 weeks approximately
 
-    # Fetch stock data
-    stock_data = yf.download(stock_ticker, start=start_date_52w.strftime(
-        '%Y-%m-%d'), end=end_date.strftime('%Y-%m-%d'))
+def calculate_price_vs_52_week_high(stock_data, end_date=None):
+    # 52 weeks approximately
+    stock_data = trailing_window(stock_data, 365, end_date)
 
     # Calculate the 52 week high
     high_52w = stock_data['High'].max()
 
     # Get the current price (most recent closing price)
-    current_price = stock_data['Close'][-1]
+    current_price = stock_data['Close'].iloc[-1]
 
     # Calculate the Price vs. 52 Week High indicator
     price_vs_52w_high = (current_price - high_52w) / high_52w * 100
@@ -97,31 +122,26 @@ def calculate_price_vs_52_week_high(stock_ticker):
     return price_vs_52w_high
 
 
-def calculate_price_vs_50_day_ma(stock_ticker):
-    end_date = datetime.today()
-    # Fetch 100 days of data to cover at least 50 trading days
-    start_date_100d = end_date - timedelta(days=100)
-
-    # Fetch stock data
-    stock_data = yf.download(stock_ticker, start=start_date_100d.strftime(
-        '%Y-%m-%d'), end=end_date.strftime('%Y-%m-%d'))
+def calculate_price_vs_50_day_ma(stock_data, end_date=None):
+    # 100 days of data to cover at least 50 trading days
+    stock_data = trailing_window(stock_data, 100, end_date)
 
     # Ensure we have enough data points
     if len(stock_data) < 50:
         raise ValueError(
             "Not enough data to calculate the 50-day moving average")
 
-    # Calculate the 50 day moving average
-    stock_data['50d_MA'] = stock_data['Close'].rolling(window=50).mean()
+    # Calculate the 50 day moving average without mutating the shared frame
+    ma_50d_series = stock_data['Close'].rolling(window=50).mean().dropna()
 
     # Get the most recent data point with a valid 50-day moving average
-    latest_data = stock_data.dropna(subset=['50d_MA']).iloc[-1]
+    latest_date = ma_50d_series.index[-1]
 
     # Get the current price (most recent closing price)
-    current_price = latest_data['Close']
+    current_price = stock_data['Close'].loc[latest_date]
 
     # Get the 50-day moving average
-    ma_50d = latest_data['50d_MA']
+    ma_50d = ma_50d_series.iloc[-1]
 
     # Calculate the Price vs. 50 Day MA indicator
     price_vs_50d_ma = (current_price - ma_50d) / ma_50d * 100
@@ -129,52 +149,54 @@ def calculate_price_vs_50_day_ma(stock_ticker):
     return price_vs_50d_ma
 
 
-def calculate_price_vs_200_day_ma(stock_ticker):
-    end_date = datetime.today()
-    # Fetch 300 days of data to cover at least 200 trading days
-    start_date_300d = end_date - timedelta(days=300)
-
-    # Fetch stock data
-    stock_data = yf.download(stock_ticker, start=start_date_300d.strftime(
-        '%Y-%m-%d'), end=end_date.strftime('%Y-%m-%d'))
+def calculate_price_vs_200_day_ma(stock_data, end_date=None):
+    # 300 days of data to cover at least 200 trading days
+    stock_data = trailing_window(stock_data, 300, end_date)
 
     # Ensure we have enough data points
     if len(stock_data) < 200:
         raise ValueError(
             "Not enough data to calculate the 200-day moving average")
 
-    # Calculate the 200 day moving average
-    stock_data['200d_MA'] = stock_data['Close'].rolling(window=200).mean()
+    # Calculate the 200 day moving average without mutating the shared frame
+    ma_200d_series = stock_data['Close'].rolling(window=200).mean().dropna()
 
     # Get the most recent data point with a valid 200-day moving average
-    latest_data = stock_data.dropna(subset=['200d_MA']).iloc[-1]
+    latest_date = ma_200d_series.index[-1]
 
     # Get the current price (most recent closing price)
-    current_price = latest_data['Close']
+    current_price = stock_data['Close'].loc[latest_date]
 
     # Get the 200-day moving average
-    ma_200d = latest_data['200d_MA']
+    ma_200d = ma_200d_series.iloc[-1]
 
     # Calculate the Price vs. 200 Day MA indicator
     price_vs_200d_ma = (current_price - ma_200d) / ma_200d * 100
 
     return price_vs_200d_ma
 
-def calculate_momentum_metrics(stock_ticker, exchange = 'Nasdaq'):
-    index_ticker = '^GSPC' if exchange == 'Nasdaq' else 'ASX'
+
+def calculate_momentum_metrics(stock_ticker, exchange='Nasdaq', history=None):
+    index_ticker = benchmark_ticker(exchange)
+    if history is None:
+        history = HistoryContext(stock_ticker, index_ticker)
+
+    stock_data = history.stock_data
+    end_date = history.end_date
     momentum_metrics = {}
-    
-    periods = [1, 3, 6, 12]
-    relative_strength_results = calculate_relative_strength(
-        stock_ticker, index_ticker, periods)
-    
-    momentum_metrics.update(relative_strength_results)
-    momentum_metrics['volume_ratio_10d_3m'] = calculate_volume_ratio_10d_3m(stock_ticker)
-    momentum_metrics['volume_ratio_1d_2d'] = calculate_volume_ratio_1d_2d(stock_ticker)
-    momentum_metrics['price_52w_high'] = calculate_price_vs_52_week_high(stock_ticker)
-    momentum_metrics['price_50d_ma'] = calculate_price_vs_50_day_ma(stock_ticker)
-    momentum_metrics['price_200d_ma'] = calculate_price_vs_200_day_ma(stock_ticker)
-    
+
+    with span('metrics.momentum', ticker=stock_ticker):
+        periods = [1, 3, 6, 12]
+        relative_strength_results = calculate_relative_strength(
+            stock_data, history.index_data, periods, end_date)
+
+        momentum_metrics.update(relative_strength_results)
+        momentum_metrics['volume_ratio_10d_3m'] = calculate_volume_ratio_10d_3m(stock_data, end_date)
+        momentum_metrics['volume_ratio_1d_2d'] = calculate_volume_ratio_1d_2d(stock_data, end_date)
+        momentum_metrics['price_52w_high'] = calculate_price_vs_52_week_high(stock_data, end_date)
+        momentum_metrics['price_50d_ma'] = calculate_price_vs_50_day_ma(stock_data, end_date)
+        momentum_metrics['price_200d_ma'] = calculate_price_vs_200_day_ma(stock_data, end_date)
+
     return momentum_metrics
 
 momentum_metrics_keys = [
@@ -183,8 +205,8 @@ momentum_metrics_keys = [
     "relative_strength_6m",
     "relative_strength_12m",
     "volume_ratio_10d_3m",
-    "volume_ratio_1d_2d"
+    "volume_ratio_1d_2d",
     "price_52w_high",
     "price_50d_ma",
     "price_200d_ma"
-]
\ No newline at end of file
+]
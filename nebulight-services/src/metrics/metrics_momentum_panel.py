@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from src.metrics.metrics_momentum import momentum_metrics_keys
+
+
+class PricePanel:
+    """Close/high/volume arrays of shape (tickers, trading days) aligned on a
+    shared date axis. Days a ticker did not trade are NaN."""
+
+    def __init__(self, symbols, dates, close, high, volume, adj_close=None):
+        self.symbols = list(symbols)
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.close = np.asarray(close, dtype=float)
+        self.high = np.asarray(high, dtype=float)
+        self.volume = np.asarray(volume, dtype=float)
+        self.adj_close = self.close if adj_close is None else np.asarray(adj_close, dtype=float)
+
+
+def build_price_panel(frames):
+    """Builds a PricePanel from a dict of per-ticker OHLCV frames as returned by yf.download."""
+    symbols = [symbol for symbol, frame in frames.items() if frame is not None and not frame.empty]
+    if not symbols:
+        # A batch where nothing came back: a panel without rows or days
+        empty = np.empty((0, 0))
+        return PricePanel([], np.empty(0, dtype='datetime64[ns]'), empty, empty, empty)
+
+    def stack(column):
+        wide = pd.concat({symbol: frames[symbol][column] for symbol in symbols}, axis=1).sort_index()
+        return wide.to_numpy(dtype=float).T, wide.index
+
+    close, dates = stack('Close')
+    high, _ = stack('High')
+    volume, _ = stack('Volume')
+    adj_close = stack('Adj Close')[0] if all('Adj Close' in frames[s] for s in symbols) else None
+
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+    return PricePanel(symbols, dates, close, high, volume, adj_close)
+
+
+def _window_start(dates, days, end_date):
+    start_date = np.datetime64((end_date - timedelta(days=days)).strftime('%Y-%m-%d'), 'ns')
+    return int(np.searchsorted(dates, start_date, side='left'))
+
+
+def _valid_from_right(values):
+    """For each cell, how many valid (non-NaN) cells of its row lie at or after it."""
+    valid = ~np.isnan(values)
+    return valid, np.cumsum(valid[:, ::-1], axis=1)[:, ::-1]
+
+
+def _nth_last(values, n):
+    """The n-th last valid value of every row (n=1 is the latest), NaN if the row is too short."""
+    if values.shape[1] == 0:
+        return np.full(values.shape[0], np.nan)
+    valid, from_right = _valid_from_right(values)
+    hit = valid & (from_right == n)
+    found = hit.any(axis=1)
+    picked = values[np.arange(values.shape[0]), hit.argmax(axis=1)]
+    return np.where(found, picked, np.nan)
+
+
+def _first_valid(values):
+    if values.shape[1] == 0:
+        return np.full(values.shape[0], np.nan)
+    valid = ~np.isnan(values)
+    found = valid.any(axis=1)
+    picked = values[np.arange(values.shape[0]), valid.argmax(axis=1)]
+    return np.where(found, picked, np.nan)
+
+
+def _tail_mean(values, n):
+    """Mean of the last n valid values of every row and how many were available."""
+    valid, from_right = _valid_from_right(values)
+    tail = valid & (from_right <= n)
+    count = tail.sum(axis=1)
+    total = np.where(tail, values, 0.0).sum(axis=1)
+    return total / np.where(count == 0, np.nan, count), count
+
+
+def calculate_momentum_panel(panel, index_close, end_date=None):
+    """
+    Computes every momentum metric for all tickers of the panel in one pass.
+
+    :param panel: PricePanel for the universe.
+    :param index_close: Benchmark adjusted close aligned on panel.dates (NaN where missing).
+    :param end_date: Day the trailing windows are measured from, defaults to today.
+    :return: DataFrame indexed by symbol with momentum_metrics_keys as columns.
+    """
+    end_date = end_date or datetime.today()
+    dates = panel.dates
+    index_close = np.asarray(index_close, dtype=float).reshape(1, -1)
+    metrics = {}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stock_end_price = _nth_last(panel.adj_close, 1)
+        index_end_price = _nth_last(index_close, 1)
+        for period, days in ((1, 30), (3, 90), (6, 180), (12, 365)):
+            start = _window_start(dates, days, end_date)
+            stock_change = stock_end_price / _first_valid(panel.adj_close[:, start:])
+            index_change = index_end_price / _first_valid(index_close[:, start:])
+            metrics[f'relative_strength_{period}m'] = 100 * (stock_change / index_change - 1)
+
+        volume_3m = panel.volume[:, _window_start(dates, 90, end_date):]
+        avg_volume_10d, _ = _tail_mean(volume_3m, 10)
+        avg_volume_3m, _ = _tail_mean(volume_3m, volume_3m.shape[1])
+        metrics['volume_ratio_10d_3m'] = (avg_volume_10d - avg_volume_3m) / avg_volume_3m * 100
+
+        volume_10d = panel.volume[:, _window_start(dates, 10, end_date):]
+        current_volume = _nth_last(volume_10d, 1)
+        previous_day_volume = _nth_last(volume_10d, 2)
+        metrics['volume_ratio_1d_2d'] = (current_volume - previous_day_volume) / previous_day_volume * 100
+
+        start_52w = _window_start(dates, 365, end_date)
+        high_52w = np.fmax.reduce(panel.high[:, start_52w:], axis=1, initial=-np.inf)
+        high_52w[np.isneginf(high_52w)] = np.nan
+        current_price = _nth_last(panel.close[:, start_52w:], 1)
+        metrics['price_52w_high'] = (current_price - high_52w) / high_52w * 100
+
+        for window, days in ((50, 100), (200, 300)):
+            close = panel.close[:, _window_start(dates, days, end_date):]
+            moving_average, count = _tail_mean(close, window)
+            moving_average = np.where(count < window, np.nan, moving_average)
+            current_price = _nth_last(close, 1)
+            metrics[f'price_{window}d_ma'] = (current_price - moving_average) / moving_average * 100
+
+    return pd.DataFrame(metrics, index=pd.Index(panel.symbols, name='symbol'))[momentum_metrics_keys]
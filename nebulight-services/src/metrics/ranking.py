@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+
+def _average_ranks(values, codes):
+    """
+    Ascending 1-based ranks of every column of a (rows, metrics) float matrix,
+    within the groups given by the integer codes of the rows.
+
+    One sort per column orders the rows by group, then value, with NaN last;
+    tied values share the mean of the positions they span, as in pandas'
+    rank(method='average'). NaN cells get a NaN rank. Returns the ranks and, for
+    every cell, the number of ranked values in its row's group.
+    """
+    rows = values.shape[0]
+    order = np.empty(values.shape, dtype=np.intp)
+    for column in range(values.shape[1]):
+        order[:, column] = np.lexsort((values[:, column], codes))
+    ordered = np.take_along_axis(values, order, axis=0)
+    ordered_codes = codes[order]
+    valid = ~np.isnan(ordered)
+
+    positions = np.broadcast_to(np.arange(rows).reshape(-1, 1), values.shape)
+    starts_code = np.ones(values.shape, dtype=bool)
+    starts_code[1:] = ordered_codes[1:] != ordered_codes[:-1]
+    starts_group = starts_code.copy()
+    starts_group[1:] |= ordered[1:] != ordered[:-1]
+    ends_group = np.ones(values.shape, dtype=bool)
+    ends_group[:-1] = starts_group[1:]
+    # Spread the first and last position of every run of equal values over the run
+    code_start = np.maximum.accumulate(np.where(starts_code, positions, 0), axis=0)
+    group_start = np.maximum.accumulate(np.where(starts_group, positions, 0), axis=0)
+    group_end = np.minimum.accumulate(np.where(ends_group, positions, rows)[::-1], axis=0)[::-1]
+
+    ordered_ranks = np.where(valid, (group_start + group_end) / 2 + 1 - code_start, np.nan)
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, ordered_ranks, axis=0)
+
+    counts = np.zeros((codes.max(initial=0) + 1, values.shape[1]))
+    np.add.at(counts, codes, ~np.isnan(values))
+    return ranks, counts[codes]
+
+
+def _metric_values(df, metrics):
+    metrics = [metric for metric in metrics if metric in df.columns]
+    return metrics, df[metrics].to_numpy(dtype=float)
+
+
+def rank_metrics(df, metrics):
+    """
+    Ranks and percentiles of every metric over all rows of df.
+
+    <metric>_rank is 1 for the highest value and <metric>_percentile is the
+    ascending rank as a share of the ranked values, times 100. Ties share their
+    average rank and missing values stay NaN, matching pandas' rank(). Metrics
+    missing from df are skipped.
+
+    :return: DataFrame on df's index holding the rank and percentile columns, to be
+        added to df in one block.
+    """
+    metrics, values = _metric_values(df, metrics)
+    ascending_ranks, counts = _average_ranks(values, np.zeros(len(df), dtype=np.intp))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        descending_ranks = counts + 1 - ascending_ranks
+        percentiles = ascending_ranks / counts * 100
+
+    columns = {}
+    for position, metric in enumerate(metrics):
+        columns[f'{metric}_rank'] = descending_ranks[:, position]
+        columns[f'{metric}_percentile'] = percentiles[:, position]
+    return pd.DataFrame(columns, index=df.index)
+
+
+def group_percentiles(df, metrics, groups, name):
+    """
+    Percentiles of every metric within the groups of the rows, in one pass over
+    all groups. Rows without a group get NaN.
+
+    :param groups: Group label of every row of df, e.g. its sector.
+    :param name: Group kind used in the column names, <metric>_<name>_percentile.
+    """
+    metrics, values = _metric_values(df, metrics)
+    codes, _ = pd.factorize(np.asarray(groups, dtype=object))
+    grouped = codes >= 0
+    # Rows without a group are ranked together and blanked afterwards
+    codes = np.where(grouped, codes, codes.max(initial=-1) + 1)
+    ascending_ranks, counts = _average_ranks(values, codes)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentiles = np.where(grouped.reshape(-1, 1), ascending_ranks / counts * 100, np.nan)
+
+    columns = {f'{metric}_{name}_percentile': percentiles[:, position] for position, metric in enumerate(metrics)}
+    return pd.DataFrame(columns, index=df.index)
@@ -0,0 +1,221 @@
+import io
+import os
+import uuid
+import boto3
+from botocore.exceptions import ClientError
+from contextlib import contextmanager
+from src.instrumentation import span
+
+# Objects are uploaded in parts of this size; anything smaller goes up with a
+# single put_object. S3 requires parts of at least 5 MiB.
+MULTIPART_PART_SIZE = int(os.getenv('MULTIPART_PART_SIZE', 8 * 1024 * 1024))
+
+
+class S3UploadStream(io.RawIOBase):
+    """
+    Writable stream into an S3 object that never touches the disk.
+
+    Bytes are buffered in memory and shipped as multipart upload parts once a
+    part is full; if the stream is closed before that, the object is written with
+    one put_object instead.
+    """
+
+    def __init__(self, s3_client, bucket, key, part_size=MULTIPART_PART_SIZE):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.position = 0
+        self.upload_id = None
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        part_number = len(self.parts) + 1
+        with span('s3.upload_part', key=self.key, part=part_number) as upload:
+            upload.bytes = len(self.buffer)
+            response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                  PartNumber=part_number, Body=bytes(self.buffer))
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer.clear()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                with span('s3.put_object', key=self.key) as upload:
+                    upload.bytes = len(self.buffer)
+                    self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+            else:
+                if self.buffer:
+                    self._upload_part()
+                self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                         MultipartUpload={'Parts': self.parts})
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            super().close()
+
+    def abort(self):
+        """Drops the upload, so no partial object or orphaned parts are left behind."""
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self.buffer.clear()
+        super().close()
+
+
+class ObjectStore:
+    """Key/value blob storage backed by an S3 bucket or a local directory."""
+
+    def __init__(self, bucket=None, root=None):
+        self.bucket = bucket
+        self.root = root
+        self.s3_client = boto3.client('s3') if bucket else None
+
+    def get(self, key):
+        if self.s3_client:
+            with span('s3.get_object', key=key) as download:
+                try:
+                    body = self.s3_client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+                except ClientError as e:
+                    if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                        download.fields['missing'] = True
+                        return None
+                    raise
+                download.bytes = len(body)
+                return body
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def version(self, key):
+        """
+        Identifies the current content of key without downloading it, None when
+        it is missing. Rewriting an object under the same key changes it.
+        """
+        if self.s3_client:
+            try:
+                head = self.s3_client.head_object(Bucket=self.bucket, Key=key)
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                    return None
+                raise
+            return f"{head['ETag']}@{head['LastModified'].isoformat()}"
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+    def put(self, key, body):
+        if self.s3_client:
+            self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=body)
+            return
+        with self.open_write(key) as f:
+            f.write(body)
+
+    @contextmanager
+    def open_write(self, key):
+        """
+        Writable stream into key. The object only appears once the block exits
+        without an error.
+        """
+        if self.s3_client:
+            stream = S3UploadStream(self.s3_client, self.bucket, key)
+            try:
+                yield stream
+            except Exception:
+                stream.abort()
+                raise
+            stream.close()
+            return
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent readers never see a partial file; the
+        # temporary name is unique so concurrent writers of a key do not collide
+        temp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                yield f
+        except Exception:
+            os.remove(temp_path)
+            raise
+        os.replace(temp_path, path)
+
+    def list(self, prefix):
+        """Returns every key starting with prefix."""
+        if self.s3_client:
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            return [item['Key'] for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+                    for item in page.get('Contents', [])]
+        keys = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                key = os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix) and not key.endswith('.tmp'):
+                    keys.append(key)
+        return sorted(keys)
+
+    def delete(self, key):
+        if self.s3_client:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=key)
+            return
+        path = os.path.join(self.root, key)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def write_parquet(store, key, df, **options):
+    """Serializes df straight into the object at key, without a temporary file."""
+    with span('parquet.write', key=key, rows=len(df)) as write:
+        with store.open_write(key) as stream:
+            df.to_parquet(stream, **options)
+            # pandas writes a local file through its name rather than the handle
+            write.bytes = stream.seek(0, io.SEEK_END) if stream.seekable() else stream.tell()
+
+
+def get_data_store():
+    """
+    Returns the store holding pipeline data: intermediate results, checkpoints and
+    published snapshots. That is S3_DATA_BUCKET, unless DATA_DIR points to a local
+    directory standing in for it.
+    """
+    data_dir = os.getenv('DATA_DIR')
+    if data_dir:
+        return ObjectStore(root=data_dir)
+    return ObjectStore(bucket=os.getenv('S3_DATA_BUCKET'))
+
+
+def get_cache_store():
+    """
+    Returns the store used to persist caches between Lambda invocations.
+
+    CACHE_BACKEND selects 's3' (S3_DATA_BUCKET) or 'local' (CACHE_DIR). When unset,
+    caches only live for the lifetime of the process and None is returned.
+    """
+    backend = os.getenv('CACHE_BACKEND')
+    if backend == 's3':
+        return ObjectStore(bucket=os.getenv('S3_DATA_BUCKET'))
+    if backend == 'local':
+        return ObjectStore(root=os.getenv('CACHE_DIR', '/tmp/nebulight-cache'))
+    return None
@@ -0,0 +1,243 @@
+import os
+import time
+import uuid
+import zlib
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from datetime import datetime, timedelta
+from io import BytesIO
+from src.concurrency import YAHOO_HOST, host_slot
+from src.instrumentation import span
+from src.object_store import get_cache_store, write_parquet
+from src.rate_limit import YAHOO, RateLimitExceeded, acquire
+
+PRICE_STORE_BUCKETS = 64
+# Bars older than this are dropped on write; it covers the longest metric window
+PRICE_STORE_RETENTION_DAYS = 400
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume', 'Dividends', 'Stock Splits']
+# Symbols requested per multi-symbol yf.download call
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 100))
+
+
+def yahoo_symbol(symbol, market='US'):
+    return symbol if market == 'US' else f'{symbol}.L'
+
+
+def symbol_bucket(symbol):
+    """Stable bucket of a symbol, the partition its bars are stored in."""
+    return zlib.crc32(symbol.encode('utf-8')) % PRICE_STORE_BUCKETS
+
+
+def download_bars(symbols, market, start, end, errors=None, bars=None, max_wait=None):
+    """
+    Downloads daily bars for many symbols with one multi-symbol yf.download call
+    per chunk and splits the result into per-symbol frames. Symbols Yahoo has
+    no bars for are left out of the returned dict; when an errors dict is given,
+    symbols whose download failed are also recorded in it with the reason.
+
+    Chunks wait up to max_wait for their Yahoo budget. Results go into bars
+    when given, so a caller keeps the chunks fetched before a RateLimitExceeded.
+    """
+    bars = {} if bars is None else bars
+    for i in range(0, len(symbols), DOWNLOAD_CHUNK_SIZE):
+        chunk = symbols[i:i + DOWNLOAD_CHUNK_SIZE]
+        yahoo_symbols = [yahoo_symbol(symbol, market) for symbol in chunk]
+        # yfinance issues one request per symbol of the chunk. Running out of budget
+        # is not a download failure: it reaches the caller, who can retry later.
+        acquire(YAHOO, cost=len(chunk), max_wait=max_wait)
+        try:
+            # yf.download keeps its results in module-level state, so chunks are
+            # fetched one after another; yfinance threads the symbols of a chunk
+            with host_slot(YAHOO_HOST):
+                with span('upstream.yahoo.download', symbols=len(chunk), start=start) as download:
+                    data = yf.download(tickers=yahoo_symbols, start=start, end=end, group_by='ticker',
+                                       actions=True, progress=False)
+                    download.fields['rows'] = len(data)
+        except Exception as e:
+            print(f"Failed to download bars for {len(chunk)} symbols: {e}")
+            if errors is not None:
+                errors.update(dict.fromkeys(chunk, str(e)))
+            continue
+        # yfinance catches per-symbol failures and keeps them, by upper case symbol,
+        # next to its results; unknown and delisted symbols are no failure
+        failures = {yahoo: error for yahoo, error in yf.shared._ERRORS.items() if 'may be delisted' not in error}
+
+        for symbol, yahoo in zip(chunk, yahoo_symbols):
+            if isinstance(data.columns, pd.MultiIndex):
+                # yfinance requests, and names its columns by, upper case symbols
+                if yahoo.upper() not in data.columns.get_level_values(0):
+                    frame = None
+                else:
+                    frame = data[yahoo.upper()].dropna(subset=['Close'])
+            else:
+                # yfinance returns flat columns when a single symbol was requested
+                frame = data.dropna(subset=['Close']) if 'Close' in data.columns else None
+            if frame is not None and not frame.empty:
+                bars[symbol] = frame
+            elif errors is not None and yahoo.upper() in failures:
+                errors[symbol] = failures[yahoo.upper()]
+    return bars
+
+
+def has_corporate_actions(bars):
+    """Whether bars include a split or dividend, after which Yahoo adjusts every earlier bar."""
+    actions = bars.reindex(columns=['Dividends', 'Stock Splits']).fillna(0)
+    return bool((actions != 0).any().any())
+
+
+class PriceStore:
+    """
+    Daily OHLCV bars of one market, stored as a Parquet dataset partitioned by
+    symbol bucket: price-store/market=<market>/bucket=<nn>/data.parquet.
+
+    Each ticker's last stored bar is known, so update() only downloads the bars
+    missing since that date instead of a full year of history.
+
+    Workers never rewrite a bucket: each update adds a delta file next to it,
+    read together with the base file, and compact() folds the deltas into the
+    base once the run's batches are done. Concurrent batches sharing a bucket
+    therefore never overwrite each other's bars.
+    """
+
+    def __init__(self, market, store):
+        self.market = market
+        self.store = store
+        self._buckets = {}
+
+    def _bucket_key(self, bucket):
+        return f'price-store/market={self.market}/bucket={bucket:02d}/data.parquet'
+
+    def _delta_prefix(self, bucket):
+        return f'price-store/market={self.market}/bucket={bucket:02d}/deltas/'
+
+    def _read_bars(self, key):
+        body = self.store.get(key)
+        return pd.read_parquet(BytesIO(body)) if body is not None else None
+
+    def _read_bucket(self, bucket):
+        """The bucket's base file merged with its deltas, and the delta keys merged."""
+        delta_keys = self.store.list(self._delta_prefix(bucket))
+        # Deltas are named by time, so later downloads of a bar win
+        frames = [self._read_bars(key) for key in [self._bucket_key(bucket)] + delta_keys]
+        frames = [frame for frame in frames if frame is not None]
+        if not frames:
+            return pd.DataFrame(columns=['symbol', 'Date'] + PRICE_COLUMNS), delta_keys
+        bars = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        bars['Date'] = pd.to_datetime(bars['Date'])
+        return bars.drop_duplicates(['symbol', 'Date'], keep='last'), delta_keys
+
+    def _load_bucket(self, bucket):
+        if bucket not in self._buckets:
+            self._buckets[bucket], _ = self._read_bucket(bucket)
+        return self._buckets[bucket]
+
+    def history(self, symbol):
+        """Stored bars of a symbol indexed by date, or None if it has none."""
+        bars = self._load_bucket(symbol_bucket(symbol))
+        bars = bars[bars['symbol'] == symbol]
+        if bars.empty:
+            return None
+        return bars.set_index('Date')[PRICE_COLUMNS]
+
+    def last_bars(self, symbols):
+        """Date of the last stored bar of each symbol, None when nothing is stored."""
+        last = {}
+        for symbol in symbols:
+            bars = self._load_bucket(symbol_bucket(symbol))
+            dates = bars.loc[bars['symbol'] == symbol, 'Date']
+            last[symbol] = dates.max() if not dates.empty else None
+        return last
+
+    def update(self, symbols, end_date=None, max_wait=None):
+        """
+        Downloads the bars missing since each symbol's last stored bar and persists
+        them. Each download waits up to max_wait for its Yahoo budget; if that runs
+        out, the bars downloaded so far are still persisted before the error is raised.
+        """
+        end_date = end_date or datetime.today()
+        end = end_date.strftime('%Y-%m-%d')
+        first_start = end_date - timedelta(days=PRICE_STORE_RETENTION_DAYS)
+
+        # Symbols sharing a last bar (usually all of them) are fetched together
+        symbols_by_start = {}
+        for symbol, last_bar in self.last_bars(symbols).items():
+            start = first_start if last_bar is None else last_bar + timedelta(days=1)
+            start = start.strftime('%Y-%m-%d')
+            # Nothing can be missing if no weekday has passed since the last bar
+            if np.busday_count(start, end) == 0:
+                continue
+            symbols_by_start.setdefault(start, []).append(symbol)
+
+        new_bars = {}
+        full_start = first_start.strftime('%Y-%m-%d')
+        full = set(symbols_by_start.get(full_start, []))
+        with span('price_store.update', symbols=len(symbols)) as update:
+            try:
+                for start, group in symbols_by_start.items():
+                    download_bars(group, self.market, start, end, bars=new_bars, max_wait=max_wait)
+                # A split or dividend in the delta changes the adjusted prices of every
+                # stored bar, so those symbols get their whole window downloaded again
+                adjusted = [symbol for symbol, bars in new_bars.items()
+                            if symbol not in full and has_corporate_actions(bars)]
+                if adjusted:
+                    print(f"Downloading the full history of {len(adjusted)} symbols after corporate actions")
+                    adjusted_bars = download_bars(adjusted, self.market, full_start, end, max_wait=max_wait)
+                    new_bars.update(adjusted_bars)
+                    full.update(adjusted_bars)
+            except RateLimitExceeded:
+                # Keep what was downloaded, except deltas whose corporate action still
+                # awaits its full window: stored, the next delta would start past it
+                self._append({symbol: bars for symbol, bars in new_bars.items()
+                              if symbol in full or not has_corporate_actions(bars)})
+                raise
+            update.fields['downloaded'] = len(new_bars)
+            update.fields['adjusted'] = len(adjusted)
+            self._append(new_bars)
+        return new_bars
+
+    def _append(self, new_bars):
+        """Writes the bars of this update to one new delta file per bucket."""
+        by_bucket = {}
+        for symbol, data in new_bars.items():
+            data = data.reindex(columns=PRICE_COLUMNS)
+            data.index = pd.DatetimeIndex(data.index).tz_localize(None)
+            data = data.rename_axis('Date').reset_index()
+            data.insert(0, 'symbol', symbol)
+            by_bucket.setdefault(symbol_bucket(symbol), []).append(data)
+
+        for bucket, frames in by_bucket.items():
+            delta = pd.concat(frames, ignore_index=True)
+            delta['Date'] = pd.to_datetime(delta['Date'])
+            delta_key = f'{self._delta_prefix(bucket)}{time.time():.6f}-{uuid.uuid4().hex[:8]}.parquet'
+            write_parquet(self.store, delta_key, delta, index=False)
+            bars = pd.concat([self._load_bucket(bucket), delta], ignore_index=True)
+            bars['Date'] = pd.to_datetime(bars['Date'])
+            self._buckets[bucket] = bars.drop_duplicates(['symbol', 'Date'], keep='last')
+
+    def compact(self, end_date=None):
+        """
+        Folds every bucket's deltas into its base file and drops bars past the
+        retention window. Runs once no worker of the market is writing.
+        """
+        end_date = end_date or datetime.today()
+        retain_from = pd.Timestamp((end_date - timedelta(days=PRICE_STORE_RETENTION_DAYS)).date())
+        compacted = 0
+        for bucket in range(PRICE_STORE_BUCKETS):
+            bars, delta_keys = self._read_bucket(bucket)
+            if not delta_keys:
+                continue
+            bars = bars[bars['Date'] >= retain_from].sort_values(['symbol', 'Date']).reset_index(drop=True)
+            write_parquet(self.store, self._bucket_key(bucket), bars, index=False)
+            # Only the deltas read above; one written meanwhile waits for the next compaction
+            for key in delta_keys:
+                self.store.delete(key)
+            self._buckets[bucket] = bars
+            compacted += len(delta_keys)
+        return compacted
+
+
+def open_price_store(market):
+    """Returns the PriceStore of a market, or None when no cache backend is configured."""
+    store = get_cache_store()
+    return PriceStore(market, store) if store else None
@@ -0,0 +1,212 @@
+import os
+import sqlite3
+import threading
+import time
+import boto3
+from src.instrumentation import record
+
+YAHOO = 'yahoo'
+ALPHA_VANTAGE = 'alphavantage'
+
+# Token bucket per provider as (requests per second, burst capacity).
+# Alpha Vantage defaults to the free tier of 5 requests per minute.
+# Override with RATE_LIMITS="yahoo=2:5,alphavantage=1.25:5".
+DEFAULT_RATE_LIMITS = {
+    YAHOO: (2.0, 5),
+    ALPHA_VANTAGE: (5 / 60, 5),
+}
+
+# Longest a caller is made to wait for a token before the request is given up
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', 60))
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+def _refill(tokens, updated_at, rate, capacity, now):
+    return min(capacity, tokens + (now - updated_at) * rate)
+
+
+def _take(tokens, rate, cost, max_wait):
+    """
+    Reserves cost tokens, which may leave the bucket in debt until it refills.
+    Returns the remaining tokens and how long to wait before spending them, or
+    the tokens untouched and None when that wait would exceed max_wait.
+    """
+    wait = max(0.0, (cost - tokens) / rate)
+    if wait > max_wait:
+        return tokens, None
+    return tokens - cost, wait
+
+
+class MemoryBackend:
+    """Buckets shared by the threads of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def take(self, provider, rate, capacity, cost, max_wait):
+        with self.lock:
+            now = time.time()
+            tokens, updated_at = self.buckets.get(provider, (capacity, now))
+            tokens, wait = _take(_refill(tokens, updated_at, rate, capacity, now), rate, cost, max_wait)
+            self.buckets[provider] = (tokens, now)
+            return wait
+
+
+class SqliteBackend:
+    """Buckets in a SQLite file, shared by every process that can reach the file."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limit_buckets '
+                '(provider TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def take(self, provider, rate, capacity, cost, max_wait):
+        conn = self._connect()
+        try:
+            # Take the write lock up front so the read-modify-write is atomic
+            conn.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            row = conn.execute(
+                'SELECT tokens, updated_at FROM rate_limit_buckets WHERE provider = ?', (provider,)).fetchone()
+            tokens, updated_at = row if row else (capacity, now)
+            tokens, wait = _take(_refill(tokens, updated_at, rate, capacity, now), rate, cost, max_wait)
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_limit_buckets (provider, tokens, updated_at) VALUES (?, ?, ?)',
+                (provider, tokens, now))
+            conn.execute('COMMIT')
+            return wait
+        finally:
+            conn.close()
+
+
+class DynamoDbBackend:
+    """Buckets in a DynamoDB table, shared by all concurrently running Lambdas."""
+
+    def __init__(self, table_name):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+
+    def take(self, provider, rate, capacity, cost, max_wait):
+        while True:
+            now = time.time()
+            item = self.table.get_item(Key={'provider': provider}, ConsistentRead=True).get('Item')
+            if item:
+                tokens, updated_at = float(item['tokens']), float(item['updated_at'])
+            else:
+                tokens, updated_at = capacity, now
+            tokens, wait = _take(_refill(tokens, updated_at, rate, capacity, now), rate, cost, max_wait)
+            if wait is None:
+                return None
+            # Optimistic concurrency on a version counter: the first write only succeeds
+            # if no other worker created the bucket meanwhile, later ones only if nobody
+            # updated it since it was read. Losers read the bucket again.
+            version = int(item['version']) if item else 0
+            if item:
+                condition = {'ConditionExpression': 'version = :version',
+                             'ExpressionAttributeValues': {':version': version}}
+            else:
+                condition = {'ConditionExpression': 'attribute_not_exists(provider)'}
+            try:
+                self.table.put_item(
+                    Item={'provider': provider, 'tokens': str(tokens), 'updated_at': str(now), 'version': version + 1},
+                    **condition)
+                return wait
+            except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+                continue
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Backend selected by RATE_LIMIT_BACKEND: 'memory' (default), 'sqlite' or 'dynamodb'."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            backend = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+            if backend == 'sqlite':
+                _backend = SqliteBackend(os.getenv('RATE_LIMIT_DB', '/tmp/nebulight-rate-limit.db'))
+            elif backend == 'dynamodb':
+                _backend = DynamoDbBackend(os.getenv('RATE_LIMIT_TABLE'))
+            else:
+                _backend = MemoryBackend()
+        return _backend
+
+
+def rate_limits():
+    limits = dict(DEFAULT_RATE_LIMITS)
+    for entry in filter(None, os.getenv('RATE_LIMITS', '').split(',')):
+        provider, quota = entry.split('=')
+        rate, capacity = quota.split(':')
+        limits[provider.strip()] = (float(rate), int(capacity))
+    return limits
+
+
+def acquire(provider, cost=1, max_wait=None):
+    """
+    Blocks until `cost` requests to provider fit in its token bucket.
+
+    Tokens are reserved at most a bucket's capacity at a time, waiting for each
+    slice to refill before reserving the next, so a large cost never leaves the
+    shared bucket deep in debt for every other caller. A slice is only taken if
+    it can be had before max_wait (RATE_LIMIT_MAX_WAIT by default) has passed;
+    otherwise RateLimitExceeded is raised, so callers can skip the request
+    rather than run into the Lambda timeout. Slices already waited for are
+    spent. Call it before taking a host slot, so waiting never holds one.
+    """
+    rate, capacity = rate_limits()[provider]
+    max_wait = RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+    backend = get_backend()
+    started_at = time.time()
+    deadline = started_at + max_wait
+    waits = 0
+    try:
+        remaining = cost
+        while remaining > 0:
+            tokens = min(remaining, capacity)
+            wait = backend.take(provider, rate, capacity, tokens, max(0.0, deadline - time.time()))
+            if wait is None:
+                raise RateLimitExceeded(f"No {provider} request budget left within {max_wait}s")
+            if wait:
+                waits += 1
+                time.sleep(wait)
+            remaining -= tokens
+    finally:
+        # Only throttled calls are worth a span
+        if waits:
+            record('rate_limit.wait', time.time() - started_at, retries=waits, provider=provider, cost=cost)
+
+
+class RequestBudget:
+    """
+    Requests a run may send to a provider within a time budget: the burst plus
+    what the bucket refills meanwhile. Work beyond it is skipped up front rather
+    than left waiting for tokens until the Lambda times out.
+    """
+
+    def __init__(self, provider, seconds):
+        rate, capacity = rate_limits()[provider]
+        self.provider = provider
+        self.remaining = int(capacity + rate * seconds)
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Claims one request, False once the budget is spent."""
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def exhaust(self):
+        with self.lock:
+            self.remaining = 0
@@ -4,7 +4,6 @@ from sqlalchemy.orm import sessionmaker
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import os
-from tempfile import NamedTemporaryFile
 import boto3
 import pandas as pd
 import fastparquet as fp
@@ -12,7 +11,10 @@ from io import BytesIO
 import yfinance as yf
 from .models import Industry, Ticker
 from .database import engine
-from .metrics.metrics_momentum import calculate_momentum_metrics
+from .metrics.metrics_momentum import calculate_momentum_metrics, momentum_metrics_keys
+from .metrics.ranking import rank_metrics
+from .object_store import get_data_store, write_parquet
+from .rate_limit import YAHOO, acquire
 import time
 import warnings
 
@@ -88,6 +90,7 @@ warnings.filterwarnings("ignore", category=FutureWarning, message=".*treating ke
 def fetch_stock_data(ticker_symbol):
     try:
         ticker = yf.Ticker(ticker_symbol)
+        acquire(YAHOO)
         df = ticker.history(period='1d')
 
         if df.empty:
@@ -108,7 +111,6 @@ def fetch_stock_data(ticker_symbol):
 
 def upload_stock_data(ticker_symbols, market, exchange=None):
     s3_bucket = os.getenv('S3_DATA_BUCKET')
-    s3_client = boto3.client('s3')
 
     combined_data = []
 
@@ -121,7 +123,6 @@ def upload_stock_data(ticker_symbols, market, exchange=None):
             if data is not None:
                 combined_data.append(data)
                 print(f"Data fetched successfully for symbol: {symbol}")
-            time.sleep(0.5)  # Introducing a delay of 1 second between requests
 
     if not combined_data:
         print("No data to upload.")
@@ -130,35 +131,16 @@ def upload_stock_data(ticker_symbols, market, exchange=None):
     # Combine all data into a single DataFrame
     combined_df = pd.concat(combined_data)
 
-    # Ensure there are metrics to process
-    if not combined_df.empty and any(col.startswith('momentum_metrics') for col in combined_df.columns):
-        metrics_df = combined_df[[col for col in combined_df.columns if col.startswith('momentum_metrics')]]
-        # Compute ranks and percentiles for each metric
-        for metric in metrics_df.columns:
-            combined_df[f'{metric}_rank'] = combined_df[metric].rank(ascending=False)
-            combined_df[f'{metric}_percentile'] = combined_df[metric].rank(pct=True) * 100
-
-    # Create temporary file to store the data in Parquet format
-    with NamedTemporaryFile(delete=False) as temp_file:
-        temp_file_path = temp_file.name
-        combined_df.to_parquet(temp_file_path)
+    # Compute ranks and percentiles for every metric in one pass
+    combined_df = pd.concat([combined_df, rank_metrics(combined_df, momentum_metrics_keys)], axis=1)
 
     # Upload the Parquet file to S3 with partitioned directory structure
     try:
-        if not combined_df.empty:
-            for _, row in combined_df.iterrows():
-                file_name = f"market-data/market={market}/year={combined_df.index.year[0]}/month={combined_df.index.month[0]}/day={combined_df.index.day[0]}/data.parquet"
-
-                with open(temp_file_path, 'rb') as file_data:
-                    s3_client.put_object(Bucket=s3_bucket, Key=file_name, Body=file_data)
-
-            print(f"File uploaded successfully to bucket '{s3_bucket}' with partitioned structure.")
-        else:
-            print("No data to upload to S3.")
+        file_name = f"market-data/market={market}/year={combined_df.index.year[0]}/month={combined_df.index.month[0]}/day={combined_df.index.day[0]}/data.parquet"
+        write_parquet(get_data_store(), file_name, combined_df)
+        print(f"File uploaded successfully to bucket '{s3_bucket}' with partitioned structure.")
     except Exception as e:
         print(f"Error uploading file to S3: {e}")
-    finally:
-        os.remove(temp_file_path)  # Clean up the temporary file
 
 
         
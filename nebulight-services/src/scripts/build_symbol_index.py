@@ -0,0 +1,99 @@
+"""
+Builds the offline symbol search index (src/symbol_index.py) from the
+reference-data CSVs and the nebulight_tickers table. Run before deploying:
+
+    python -m src.scripts.build_symbol_index
+    python -m src.scripts.build_symbol_index --skip-db
+"""
+import argparse
+import os
+import pandas as pd
+from src.symbol_index import REFERENCE_DATA_DIR, SYMBOL_INDEX_PATH, write_symbol_index
+
+# File, exchange and the columns holding each record field. nasdaq_instruments.csv
+# is the screener of every US listing, NYSE ones included, so the NYSE file goes
+# first and the NASDAQ one only adds the symbols not listed there.
+REFERENCE_LISTINGS = [
+    ('nyse_instruments.csv', 'NYSE', {'ticker': 'Symbol', 'name': 'Name', 'sector': 'Sector',
+                                      'industry': 'Industry', 'market_cap': 'Market Cap'}),
+    ('nasdaq_instruments.csv', 'NASDAQ', {'ticker': 'Symbol', 'name': 'Name', 'sector': 'Sector',
+                                          'industry': 'Industry', 'market_cap': 'Market Cap'}),
+    ('lse_instruments.csv', 'LSE', {'ticker': 'TIDM', 'name': 'Issuer Name', 'isin': 'ISIN',
+                                    'type': 'MiFIR Identifier Description', 'sector': 'ICB Industry',
+                                    'industry': 'ICB Super-Sector Name'}),
+]
+# Asset types as LISTING_STATUS names them. The US screeners only list stocks;
+# LSE types come from the MiFIR description, where anything but ETFs is equity.
+LISTING_TYPES = {'ETFs': 'ETF'}
+DEFAULT_LISTING_TYPE = 'Stock'
+
+
+def _market(exchange):
+    return 'UK' if exchange == 'LSE' else 'US'
+
+
+def load_reference_listings():
+    records = {}
+    for file_name, exchange, columns in REFERENCE_LISTINGS:
+        listing = pd.read_csv(os.path.join(REFERENCE_DATA_DIR, file_name), usecols=list(columns.values()),
+                              dtype=str, keep_default_na=False)
+        listing = listing.rename(columns={column: field for field, column in columns.items()})
+        for row in listing.to_dict('records'):
+            record = {field: value.strip() for field, value in row.items()}
+            if not record['ticker']:
+                continue
+            record['exchange'] = exchange
+            record['market_cap'] = float(record.get('market_cap') or 0)
+            record['type'] = LISTING_TYPES.get(record.get('type'), DEFAULT_LISTING_TYPE)
+            # A ticker already read from an earlier file keeps that exchange
+            records.setdefault((_market(exchange), record['ticker'].upper()), record)
+    return records
+
+
+def load_tracked_tickers():
+    """Tickers the pipeline tracks, with the database's name, type and sector."""
+    from sqlalchemy.orm import sessionmaker
+    from src.database import engine
+    from src.models import Sector, Ticker
+
+    session = sessionmaker(bind=engine)()
+    try:
+        rows = session.query(Ticker.ticker_symbol, Ticker.exchange, Ticker.company_name, Ticker.type, Sector.name) \
+            .outerjoin(Sector, Ticker.sector_id == Sector.id).all()
+    finally:
+        session.close()
+    return [{'ticker': ticker, 'exchange': exchange, 'name': name or '', 'type': type or '', 'sector': sector or ''}
+            for ticker, exchange, name, type, sector in rows]
+
+
+def merge_listings(records, tracked):
+    """Adds the tracked tickers, filling gaps in the reference data, and flags them."""
+    for ticker in tracked:
+        key = (_market(ticker['exchange']), ticker['ticker'].upper())
+        record = records.setdefault(key, {'ticker': ticker['ticker'], 'exchange': ticker['exchange'], 'market_cap': 0.0})
+        for field in ('name', 'type', 'sector'):
+            if not record.get(field) and ticker[field]:
+                record[field] = ticker[field]
+        record['tracked'] = True
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the offline symbol search index.')
+    parser.add_argument('--output', default=SYMBOL_INDEX_PATH)
+    parser.add_argument('--skip-db', action='store_true', help='index the reference data only')
+    args = parser.parse_args()
+
+    records = load_reference_listings()
+    if not args.skip_db:
+        records = merge_listings(records, load_tracked_tickers())
+
+    # Equally good matches come back in this order: tracked tickers, then the largest companies
+    ordered = sorted(records.values(),
+                     key=lambda record: (not record.get('tracked'), -record['market_cap'], record['ticker']))
+    size = write_symbol_index(args.output, ordered)
+    print(f"Wrote {len(ordered)} symbols to {args.output} ({size / 1024:.0f} KiB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,90 +1,148 @@
+import math
 import os
-import json
-from datetime import datetime
-from fastapi import APIRouter
-from sqlalchemy.engine import create_engine
-from sqlalchemy.sql import text
-from .utils import nanoseconds_to_iso
-
-# Athena configuration
-ATHENA_DATABASE = os.getenv('ATHENA_DATABASE')
-ATHENA_OUTPUT_LOCATION = os.getenv('ATHENA_OUTPUT_LOCATION')
-ATHENA_REGION = os.getenv('ATHENA_REGION')
+import threading
+import time
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+from .object_store import get_data_store
+from .metrics.metrics_momentum import momentum_metrics_keys
+from .stocks_snapshot.snapshot import latest_snapshot_key, read_snapshot
+
+# How often a process checks the bucket for a newer snapshot partition
+SNAPSHOT_REFRESH_SECONDS = int(os.getenv('SNAPSHOT_REFRESH_SECONDS', 300))
+# Markets searched, in order, when a request does not name one
+REPORT_MARKETS = ['US', 'UK']
 
 router = APIRouter()
 
-# # Create SQLAlchemy engine
-# engine = create_engine(
-#     f'awsathena+rest://:@athena.{ATHENA_REGION}.amazonaws.com:443/{ATHENA_DATABASE}?s3_staging_dir={ATHENA_OUTPUT_LOCATION}'
-# )
-
-# def format_response(result):
-#     market_data = [
-#         "high",
-#         "low",
-#         "open",
-#         "close",
-#         "dividends",
-#         "volume",
-#         "stock splits"
-#     ]
-    
-#     momentum_metrics = [
-#         "relative_strength_1m",
-#         "relative_strength_3m",
-#         "relative_strength_6m",
-#         "relative_strength_12m",
-#         "volume_ratio_10d_3m",
-#         "volume_ratio_1d_2d"
-#         "price_52w_high",
-#         "price_50d_ma",
-#         "price_200d_ma"
-#     ]
-    
-#     rank_suffix = "_rank"
-#     percentile_suffix = "_percentile"
-    
-#     response = {
-#         "symbol": result["symbol"],
-#         "market_data": {},
-#         "momentum_metrics": {},
-#         "date": nanoseconds_to_iso(result["date"]),
-#     }
-    
-#     for metric in market_data:
-#         response["market_data"][metric] = round(result[metric], 2)
-    
-#     for metric in momentum_metrics:
-#         metric_value = result.get(metric)
-#         metric_percentile = result.get(metric + percentile_suffix)
-#         metric_rank = result.get(metric + rank_suffix)
-        
-#         if metric_value is not None and metric_percentile is not None and metric_rank is not None:
-#             response["momentum_metrics"][metric] = {
-#                 "value": round(result[metric], 2),
-#                 "market": {
-#                     "percentile": round(result[metric + percentile_suffix], 2),
-#                     "rank": result[metric + rank_suffix]
-#                 }
-#             }
-    
-#     return response
-
-# router = APIRouter()
-
-# @router.get('/stock/{symbol}')
-# def get_stock_report(symbol):
-#     query = text("""
-#         SELECT * FROM nebulight_data
-#         WHERE symbol = :symbol
-#         ORDER BY date DESC
-#         LIMIT 1
-#     """)
-#     with engine.connect() as conn:
-#         result = conn.execute(query, {'symbol': symbol}).fetchone()
-    
-#     if result:
-#         result_dict = result._asdict()
-#         return format_response(result_dict)
-#     else:
-#         return {'error': 'Stock symbol not found'}, 404
+MARKET_DATA_COLUMNS = {
+    "high": "High",
+    "low": "Low",
+    "open": "Open",
+    "close": "Close",
+    "dividends": "Dividends",
+    "volume": "Volume",
+    "stock splits": "Stock Splits",
+}
+
+rank_suffix = "_rank"
+percentile_suffix = "_percentile"
+
+
+class MarketSnapshot:
+    """The latest snapshot of a market as an Arrow table, with a symbol -> row index."""
+
+    def __init__(self, key, version, table):
+        self.key = key
+        self.version = version
+        self.table = table
+        self.rows = {symbol: row for row, symbol in enumerate(table.column('symbol').to_pylist())}
+
+    def get(self, symbol):
+        row = self.rows.get(symbol)
+        if row is None:
+            return None
+        return self.table.slice(row, 1).to_pylist()[0]
+
+
+_snapshots = {}
+_checked_at = {}
+# One per market, so a slow UK reload never holds up US requests
+_refresh_locks = {}
+
+
+def _refresh_snapshot(market):
+    try:
+        store = get_data_store()
+        key = latest_snapshot_key(store, market)
+        if key is None:
+            return
+        # A rerun of the same day's combine rewrites the same key
+        version = store.version(key)
+        current = _snapshots.get(market)
+        if current is None or (current.key, current.version) != (key, version):
+            table = read_snapshot(store, key)
+            if table is not None:
+                _snapshots[market] = MarketSnapshot(key, version, table)
+                print(f"Loaded {market} snapshot {key} with {table.num_rows} rows")
+    except Exception as e:
+        # Keep serving what is loaded; the next check tries again
+        print(f"Error refreshing the {market} snapshot: {e}")
+
+
+def get_snapshot(market):
+    """
+    The market's snapshot held by this process. The bucket is listed at most
+    every SNAPSHOT_REFRESH_SECONDS and the snapshot reloaded only when a newer
+    partition, or a rewrite of the latest one, has appeared, so requests in
+    between never leave the process. While one request reloads, the others keep
+    reading the previous snapshot; only the first load is waited for.
+    """
+    now = time.time()
+    if now - _checked_at.get(market, 0) < SNAPSHOT_REFRESH_SECONDS:
+        return _snapshots.get(market)
+    lock = _refresh_locks.setdefault(market, threading.Lock())
+    if not lock.acquire(blocking=market not in _snapshots):
+        return _snapshots.get(market)
+    try:
+        if now - _checked_at.get(market, 0) >= SNAPSHOT_REFRESH_SECONDS:
+            _refresh_snapshot(market)
+            _checked_at[market] = now
+    finally:
+        lock.release()
+    return _snapshots.get(market)
+
+
+def _rounded(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return round(value, 2)
+
+
+def format_response(result, market):
+    response = {
+        "symbol": result["symbol"],
+        "market": market,
+        "sector": result.get("sector"),
+        "industry": result.get("industry"),
+        "pe_ratio_ttm": _rounded(result.get("pe_ratio_ttm")),
+        "market_data": {},
+        "momentum_metrics": {},
+        "date": result["Date"].isoformat() if result.get("Date") else None,
+    }
+
+    for metric, column in MARKET_DATA_COLUMNS.items():
+        response["market_data"][metric] = _rounded(result.get(column))
+
+    for metric in momentum_metrics_keys:
+        metric_value = _rounded(result.get(metric))
+        metric_percentile = _rounded(result.get(metric + percentile_suffix))
+        metric_rank = result.get(metric + rank_suffix)
+
+        if metric_value is not None and metric_percentile is not None and metric_rank is not None:
+            response["momentum_metrics"][metric] = {
+                "value": metric_value,
+                "market": {
+                    "percentile": metric_percentile,
+                    "rank": int(metric_rank)
+                },
+                "sector": {"percentile": _rounded(result.get(f"{metric}_sector{percentile_suffix}"))},
+                "industry": {"percentile": _rounded(result.get(f"{metric}_industry{percentile_suffix}"))},
+            }
+
+    return response
+
+
+@router.get('/stock/{symbol}')
+def get_stock_report(symbol: str, market: Optional[str] = None):
+    symbol = symbol.strip().upper()
+    # Snapshots key London listings without Yahoo's suffix
+    if symbol.endswith('.L'):
+        symbol, market = symbol[:-2], 'UK'
+    markets = [market] if market else REPORT_MARKETS
+    for candidate in markets:
+        snapshot = get_snapshot(candidate)
+        result = snapshot.get(symbol) if snapshot else None
+        if result:
+            return format_response(result, candidate)
+    raise HTTPException(status_code=404, detail='Stock symbol not found')
@@ -0,0 +1,99 @@
+import json
+import os
+import time
+import uuid
+import statistics
+
+# Expected wall time of one worker batch; leaves headroom below the 900s Lambda timeout
+TARGET_BATCH_SECONDS = float(os.getenv('TARGET_BATCH_SECONDS', 600))
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 500))
+# Cost assumed for every ticker before any run has been measured, i.e. the old
+# fixed batches of 100
+DEFAULT_TICKER_SECONDS = 6.0
+# Weight of the latest run in the moving averages
+COST_SMOOTHING = 0.3
+
+
+def _stats_prefix(market):
+    return f'pipeline-stats/market={market}/'
+
+
+def record_batch_costs(store, market, ticker_seconds, failed, batch_seconds):
+    """
+    Persists what each ticker of a worker batch cost, for the next dispatcher run.
+
+    ticker_seconds holds the time spent on each ticker: its share of the batched
+    download, its metrics and its earnings lookup, rate limit waits included. The
+    batch wall time is apportioned in proportion to it, so the rest of the shared
+    work is charged to the tickers that caused it.
+    """
+    total = sum(ticker_seconds.values())
+    costs = {}
+    for ticker, seconds in ticker_seconds.items():
+        share = seconds / total if total > 0 else 1 / len(ticker_seconds)
+        costs[ticker] = {'seconds': batch_seconds * share, 'failed': ticker in failed}
+    key = f'{_stats_prefix(market)}runs/{time.time()}-{uuid.uuid4().hex[:8]}.json'
+    store.put(key, json.dumps(costs).encode('utf-8'))
+
+
+def load_ticker_costs(store, market):
+    """Folds the per-batch records of previous runs into per-ticker moving averages."""
+    costs_key = f'{_stats_prefix(market)}ticker_costs.json'
+    body = store.get(costs_key)
+    ticker_costs = json.loads(body) if body else {}
+
+    run_keys = store.list(f'{_stats_prefix(market)}runs/')
+    for run_key in run_keys:
+        for ticker, run in json.loads(store.get(run_key)).items():
+            previous = ticker_costs.get(ticker)
+            failed = 1.0 if run['failed'] else 0.0
+            if previous is None:
+                ticker_costs[ticker] = {'seconds': run['seconds'], 'failure_rate': failed}
+            else:
+                previous['seconds'] += COST_SMOOTHING * (run['seconds'] - previous['seconds'])
+                previous['failure_rate'] += COST_SMOOTHING * (failed - previous['failure_rate'])
+
+    if run_keys:
+        store.put(costs_key, json.dumps(ticker_costs).encode('utf-8'))
+        for run_key in run_keys:
+            store.delete(run_key)
+    return ticker_costs
+
+
+def plan_batches(tickers, ticker_costs, target_seconds=TARGET_BATCH_SECONDS, max_batch_size=MAX_BATCH_SIZE):
+    """
+    Packs tickers into batches whose expected wall time stays under target_seconds.
+
+    Tickers are packed next-fit in the order given, which keeps neighbouring
+    price store buckets in the same batch; with per-ticker costs of a few
+    seconds against a budget of minutes, next-fit wastes very little. Returns
+    the batches and their expected seconds.
+    """
+    known = [cost['seconds'] for cost in ticker_costs.values()]
+    default_seconds = statistics.median(known) if known else DEFAULT_TICKER_SECONDS
+
+    batches, expected = [], []
+    batch, batch_seconds = [], 0.0
+    for ticker in tickers:
+        cost = ticker_costs.get(ticker)
+        # A ticker that often fails is likely to burn retries and timeouts again
+        seconds = cost['seconds'] * (1 + cost['failure_rate']) if cost else default_seconds
+        if batch and (batch_seconds + seconds > target_seconds or len(batch) >= max_batch_size):
+            batches.append(batch)
+            expected.append(batch_seconds)
+            batch, batch_seconds = [], 0.0
+        batch.append(ticker)
+        batch_seconds += seconds
+    if batch:
+        batches.append(batch)
+        expected.append(batch_seconds)
+    return batches, expected
+
+
+def plan_summary(batches, expected):
+    return {
+        'batches': len(batches),
+        'tickers': sum(len(batch) for batch in batches),
+        'expected_seconds': [round(seconds, 1) for seconds in expected],
+        'max_expected_seconds': round(max(expected), 1) if expected else 0,
+    }
@@ -1,60 +1,106 @@
-import boto3
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from io import BytesIO
 import os
 from datetime import datetime as dt
+from src.classifications import get_classifications
+from src.concurrency import map_in_order
+from src.instrumentation import instrumented, span
 from src.metrics.metrics_momentum import momentum_metrics_keys
-from tempfile import NamedTemporaryFile
+from src.metrics.ranking import group_percentiles, rank_metrics
+from src.object_store import get_data_store
+from src.price_store import open_price_store
+from src.stocks_snapshot.intermediate import checkpoint_prefix, intermediate_prefix, load_checkpoint, load_manifest, manifest_key, new_run_id
+from src.stocks_snapshot.snapshot import snapshot_key, write_snapshot
 
+# Parallel S3 downloads of intermediate part files
+COMBINER_CONCURRENCY = int(os.getenv('COMBINER_CONCURRENCY', 16))
+
+
+def list_part_keys(store, run_id):
+    """
+    Part files of a run. The manifest lists the expected batches and each batch
+    checkpoint lists the parts it flushed; without a manifest the run prefix is
+    listed page by page.
+    """
+    manifest = load_manifest(store, run_id)
+    if manifest is None:
+        print(f"No manifest for {run_id}, listing {intermediate_prefix(run_id)}")
+        return [key for key in store.list(intermediate_prefix(run_id)) if key.endswith('.parquet')]
+
+    batch_indexes = [batch['batch_index'] for batch in manifest['batches']]
+    checkpoints = map_in_order(lambda batch_index: load_checkpoint(store, run_id, batch_index),
+                               batch_indexes, COMBINER_CONCURRENCY)
+    missing = [batch_index for batch_index, checkpoint in zip(batch_indexes, checkpoints) if not checkpoint['parts']]
+    if missing:
+        print(f"Batches without results: {missing}")
+    return [key for checkpoint in checkpoints for key in checkpoint['parts']]
+
+
+def read_parts(store, keys):
+    """Downloads the part files concurrently and concatenates them into one Arrow table."""
+    def read_part(key):
+        return pq.read_table(BytesIO(store.get(key)))
+
+    with span('combine.read_parts', parts=len(keys)) as read:
+        tables = map_in_order(read_part, keys, COMBINER_CONCURRENCY)
+        # A metric that is null for a whole part is typed null there; promote it to the common type
+        table = pa.concat_tables(tables, promote_options='default')
+        read.bytes = table.nbytes
+        read.fields['rows'] = table.num_rows
+    return table
+
+
+@instrumented('combiner')
 def handler(event, context):
-    print(1)
-    s3_bucket = os.getenv('S3_DATA_BUCKET')
-    s3_client = boto3.client('s3')
-    
+    store = get_data_store()
+
     print(event)
-    
-    response = s3_client.list_objects_v2(Bucket=s3_bucket, Prefix='intermediate_results/')
-    files = [item['Key'] for item in response.get('Contents', [])]
-    print(files)
-    
-    combined_data = []
-    final_date: str
-    
-    for file_key in files:
-        obj = s3_client.get_object(Bucket=s3_bucket, Key=file_key)
-        df = pd.read_parquet(BytesIO(obj['Body'].read()))
-        combined_data.append(df)
-        final_date = df.index[0]
-        print(final_date)
-    
-    if not combined_data:
+    run_id = event.get('run_id') or new_run_id()
+
+    with span('combine.list_parts'):
+        files = list_part_keys(store, run_id)
+    print(f"Combining {len(files)} files of {run_id}")
+
+    if not files:
         print("No data to combine.")
         return
-    
-    print(final_date)
-    combined_df = pd.concat(combined_data)
-    
-    for metric in momentum_metrics_keys:
-        if metric in combined_df.columns:
-            combined_df[f'{metric}_rank'] = combined_df[metric].rank(ascending=False)
-            combined_df[f'{metric}_percentile'] = combined_df[metric].rank(pct=True) * 100
+
+    combined_df = read_parts(store, files).to_pandas()
 
     market = event.get('market', 'US')
-    print(event.get('date'))
-    final_date = dt.fromisoformat(event.get('date'))
-    
+
+    with span('combine.classify'):
+        classifications = get_classifications(market)
+        combined_df['sector'] = combined_df['symbol'].map(classifications['sector'])
+        combined_df['industry'] = combined_df['symbol'].map(classifications['industry'])
+
+    with span('combine.rank', rows=len(combined_df)):
+        combined_df = pd.concat([
+            combined_df,
+            rank_metrics(combined_df, momentum_metrics_keys),
+            group_percentiles(combined_df, momentum_metrics_keys, combined_df['sector'], 'sector'),
+            group_percentiles(combined_df, momentum_metrics_keys, combined_df['industry'], 'industry'),
+        ], axis=1)
+
+    # Batches that found no data report no date, fall back to the data itself
+    final_date = dt.fromisoformat(event['date']) if event.get('date') else combined_df.index.max()
+    print(final_date)
+
     combined_df.reset_index(drop=True, inplace=True)
-    
+
     combined_df['Date'] = final_date
-    
-    final_file_key = f"market-data/market={market}/year={final_date.year}/month={final_date.month}/day={final_date.day}/data.parquet"
-    
-    with NamedTemporaryFile(delete=False) as temp_file:
-        combined_df.to_parquet(temp_file.name)
-        s3_client.upload_file(temp_file.name, s3_bucket, final_file_key)
-        os.remove(temp_file.name)   
-    
-    # Clean up intermediate files
-    for file_key in files:
-        s3_client.delete_object(Bucket=s3_bucket, Key=file_key)
 
+    write_snapshot(store, snapshot_key(market, final_date), combined_df)
+
+    # Clean up the run's intermediate files and checkpoints
+    with span('combine.cleanup'):
+        for file_key in files + store.list(checkpoint_prefix(run_id)) + [manifest_key(run_id)]:
+            store.delete(file_key)
+
+    # Every worker of the run is done, so their price deltas can be folded in
+    price_store = open_price_store(market)
+    if price_store:
+        with span('combine.compact_prices') as compact:
+            compact.fields['deltas'] = price_store.compact()
@@ -1,15 +1,21 @@
 import json
 import os
-import boto3
 import datetime
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from src.config import DATABASE_URL
-from src.models import Ticker
-
-engine = create_engine(DATABASE_URL)
+from src.instrumentation import instrumented, span
+from src.object_store import get_cache_store, get_data_store
+from src.price_store import symbol_bucket
+from src.stocks_snapshot.batch_planner import load_ticker_costs, plan_batches, plan_summary
+from src.stocks_snapshot.intermediate import new_run_id, write_manifest
+from src.stocks_snapshot.negative_cache import load_negative_cache, skipped_tickers
+from src.stocks_snapshot.snapshot import mark_carry_forward
+from src.trading_calendar import run_decision
 
 def fetch_nasdaq_ticker_symbols(market='US'):
+    # Imported here so that runs naming their tickers work without a database
+    from sqlalchemy.orm import sessionmaker
+    from src.database import engine
+    from src.models import Ticker
+
     Session = sessionmaker(bind=engine)
     session = Session()
     print("fetch symbols")
@@ -18,7 +24,12 @@ def fetch_nasdaq_ticker_symbols(market='US'):
         # Assuming the Stock model has a 'symbol' column and an 'exchange' column
         ticker_symbols = session.query(Ticker.ticker_symbol).filter(Ticker.exchange == exchange).all()
         print(ticker_symbols)
-        return [symbol for (symbol,) in ticker_symbols]
+        store = get_cache_store()
+        # Delisted and unresolvable tickers sit out until their backoff ends
+        skipped = skipped_tickers(load_negative_cache(store, market)) if store else set()
+        if skipped:
+            print(f"Skipping {len(skipped)} tickers that failed in previous runs")
+        return [symbol for (symbol,) in ticker_symbols if symbol not in skipped]
     except Exception as e:
         print(f"Error fetching NASDAQ ticker symbols: {e}")
         return []
@@ -31,8 +42,8 @@ def split_list(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
+@instrumented('dispatcher')
 def handler(event, context):
-    step_functions_client = boto3.client('stepfunctions')
     state_machine_arn = os.getenv('STATE_MACHINE_ARN')
     
     if not state_machine_arn:
@@ -40,18 +51,51 @@ def handler(event, context):
     
     print(f"Using state machine ARN: {state_machine_arn}")
     market = event.get('market', 'US')
+    run_id = event.get('run_id') or new_run_id()
+    # Executions started by hand can pass force in their input to run regardless
+    force = event.get('force') or (event.get('execution_input') or {}).get('force')
 
-    
-    # Fetch ticker symbols from your database
-    ticker_symbols = fetch_nasdaq_ticker_symbols(market)
-    batch_size = 100
-    # Split the list into smaller batches
-    batches = list(split_list(ticker_symbols, batch_size))
+    # Nothing new to fetch on weekends and exchange holidays
+    decision = run_decision(market)
+    if decision['action'] != 'run' and not force:
+        print(f"No {market} session on {decision['session_date']}: {decision['action']}")
+        if decision['action'] == 'carry_forward':
+            mark_carry_forward(get_data_store(), market, decision)
+        return {
+            'statusCode': 200,
+            'body': {'tickers': [], 'market': market, 'run_id': run_id, 'plan': None, **decision}
+        }
+
+    # Fetch ticker symbols from your database, unless the run names them
+    with span('dispatch.fetch_tickers') as fetch:
+        ticker_symbols = list(event.get('tickers') or fetch_nasdaq_ticker_symbols(market))
+        fetch.fields['tickers'] = len(ticker_symbols)
+    # Keep each batch within as few price store buckets as possible
+    ticker_symbols.sort(key=lambda symbol: (symbol_bucket(symbol), symbol))
+    store = get_cache_store()
+    if store:
+        # Size batches from what each ticker cost in previous runs
+        with span('dispatch.plan'):
+            ticker_costs = load_ticker_costs(store, market)
+            batches, expected = plan_batches(ticker_symbols, ticker_costs)
+        plan = plan_summary(batches, expected)
+        print(f"Batch plan: {json.dumps(plan)}")
+    else:
+        batch_size = 100
+        # Split the list into smaller batches
+        batches = list(split_list(ticker_symbols, batch_size))
+        plan = None
+
+    write_manifest(get_data_store(), run_id, market, batches)
     
     return {
         'statusCode': 200,
         'body': {
             'tickers': batches,
-            'market': market
+            'market': market,
+            'run_id': run_id,
+            'plan': plan,
+            'action': 'run',
+            'session_date': decision['session_date']
         }
     }
\ No newline at end of file
@@ -0,0 +1,62 @@
+import json
+import uuid
+from datetime import datetime, timezone
+
+# Every execution writes its intermediate files under its own prefix, so UK and
+# US runs sharing the bucket never see each other's batches.
+
+
+def new_run_id():
+    """Id for a run invoked without one, unique so that manual runs never share files."""
+    return f"manual-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:8]}"
+
+
+def intermediate_prefix(run_id):
+    return f'intermediate_results/{run_id}/'
+
+
+def manifest_key(run_id):
+    return f'{intermediate_prefix(run_id)}manifest.json'
+
+
+def part_key(run_id, batch_index, part_index):
+    return f'{intermediate_prefix(run_id)}batch_{batch_index}_part_{part_index}.parquet'
+
+
+def checkpoint_prefix(run_id):
+    return f'checkpoints/{run_id}/'
+
+
+def checkpoint_key(run_id, batch_index):
+    return f'{checkpoint_prefix(run_id)}batch_{batch_index}.json'
+
+
+def write_manifest(store, run_id, market, batches):
+    """Records the batches the dispatcher handed out, so the combiner knows what to expect."""
+    manifest = {
+        'run_id': run_id,
+        'market': market,
+        'batches': [
+            {'batch_index': batch_index, 'checkpoint': checkpoint_key(run_id, batch_index), 'tickers': len(batch)}
+            for batch_index, batch in enumerate(batches)
+        ],
+    }
+    store.put(manifest_key(run_id), json.dumps(manifest).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(store, run_id):
+    body = store.get(manifest_key(run_id))
+    return json.loads(body) if body is not None else None
+
+
+def load_checkpoint(store, run_id, batch_index):
+    """Progress of a batch: finished tickers and flushed part files."""
+    body = store.get(checkpoint_key(run_id, batch_index))
+    if body is None:
+        return {'done': [], 'failed': [], 'parts': [], 'date': None}
+    return json.loads(body)
+
+
+def save_checkpoint(store, run_id, batch_index, checkpoint):
+    store.put(checkpoint_key(run_id, batch_index), json.dumps(checkpoint).encode('utf-8'))
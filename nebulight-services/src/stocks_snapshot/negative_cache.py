@@ -0,0 +1,66 @@
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# Consecutive failed runs before a ticker is skipped, so one bad night does not drop it
+NEGATIVE_CACHE_THRESHOLD = 2
+# Retried this many days after reaching the threshold (skipping one nightly run),
+# doubling with every further failure
+BACKOFF_BASE_DAYS = 2
+MAX_BACKOFF_DAYS = int(os.getenv('NEGATIVE_CACHE_MAX_BACKOFF_DAYS', 30))
+
+
+def _cache_prefix(market):
+    return f'negative-cache/market={market}/'
+
+
+def backoff_days(failures):
+    if failures < NEGATIVE_CACHE_THRESHOLD:
+        return 0
+    return min(MAX_BACKOFF_DAYS, BACKOFF_BASE_DAYS * 2 ** (failures - NEGATIVE_CACHE_THRESHOLD))
+
+
+def record_outcomes(store, market, succeeded, failed):
+    """
+    Persists which tickers of a worker batch returned data and which did not.
+
+    Batches write separate records, folded by the next dispatcher run, so
+    concurrent workers never overwrite each other.
+    """
+    outcomes = {'succeeded': sorted(succeeded), 'failed': sorted(failed), 'at': datetime.today().isoformat()}
+    key = f'{_cache_prefix(market)}runs/{time.time()}-{uuid.uuid4().hex[:8]}.json'
+    store.put(key, json.dumps(outcomes).encode('utf-8'))
+
+
+def load_negative_cache(store, market):
+    """Folds the batch records of previous runs into per-ticker failure counts and backoff expiries."""
+    cache_key = f'{_cache_prefix(market)}tickers.json'
+    body = store.get(cache_key)
+    entries = json.loads(body) if body else {}
+
+    run_keys = store.list(f'{_cache_prefix(market)}runs/')
+    # Records are named by time, so they fold in the order the batches ran
+    for run_key in run_keys:
+        outcomes = json.loads(store.get(run_key))
+        failed_at = datetime.fromisoformat(outcomes['at'])
+        for ticker in outcomes['succeeded']:
+            entries.pop(ticker, None)
+        for ticker in outcomes['failed']:
+            entry = entries.setdefault(ticker, {'failures': 0, 'first_failed': outcomes['at']})
+            entry['failures'] += 1
+            entry['last_failed'] = outcomes['at']
+            entry['retry_after'] = (failed_at + timedelta(days=backoff_days(entry['failures']))).date().isoformat()
+
+    if run_keys:
+        store.put(cache_key, json.dumps(entries).encode('utf-8'))
+        for run_key in run_keys:
+            store.delete(run_key)
+    return entries
+
+
+def skipped_tickers(entries, today=None):
+    """Tickers still inside their backoff window."""
+    today = (today or datetime.today()).date().isoformat()
+    return {ticker for ticker, entry in entries.items() if entry['retry_after'] > today}
@@ -0,0 +1,116 @@
+"""
+Runs the stock snapshot pipeline locally, the way serverless-state-machine.yml
+runs it on AWS: dispatcher, then one worker per batch, then the combiner.
+
+Worker batches run on a process pool and a local directory stands in for the S3
+bucket, so the whole flow can be profiled and benchmarked on a laptop:
+
+    python -m src.stocks_snapshot.run --market US --concurrency 4
+    python -m src.stocks_snapshot.run --symbols AAPL,MSFT,NVDA
+
+With --symbols no database is needed; snapshots then carry no sectors.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Matches the WorkerTask retry policy: one attempt plus two retries
+WORKER_ATTEMPTS = 3
+
+
+def configure_local_environment(data_dir):
+    """Points every store at data_dir. Must run before the handlers are imported."""
+    os.environ['DATA_DIR'] = os.path.join(data_dir, 'data')
+    os.environ['CACHE_BACKEND'] = 'local'
+    os.environ['CACHE_DIR'] = os.path.join(data_dir, 'cache')
+    # Worker processes share their upstream rate limits through one SQLite file
+    os.environ['RATE_LIMIT_BACKEND'] = 'sqlite'
+    os.environ['RATE_LIMIT_DB'] = os.path.join(data_dir, 'rate_limits.db')
+    # The dispatcher insists on it, although it does not start executions itself
+    os.environ.setdefault('STATE_MACHINE_ARN', 'local')
+    os.makedirs(data_dir, exist_ok=True)
+
+
+def run_worker(event):
+    """Runs one Map item with the state machine's retries, in a pool process."""
+    from src.stocks_snapshot import worker
+
+    started_at = time.time()
+    for attempt in range(1, WORKER_ATTEMPTS + 1):
+        try:
+            result = worker.handler(event, None)
+            return event['batch_index'], result, time.time() - started_at
+        except Exception as e:
+            print(f"Batch {event['batch_index']} attempt {attempt} failed: {e}")
+    return event['batch_index'], None, time.time() - started_at
+
+
+def run_pipeline(market, concurrency, symbols=None, force=True):
+    from src.stocks_snapshot import combiner, dispatcher
+
+    timings = {}
+    run_id = f'local-{int(time.time())}'
+
+    started_at = time.time()
+    dispatch = dispatcher.handler({'market': market, 'run_id': run_id, 'tickers': symbols, 'force': force}, None)['body']
+    timings['dispatch'] = time.time() - started_at
+    if dispatch['action'] != 'run':
+        # Where the state machine's CheckSession state ends the execution
+        return timings, []
+    batches = dispatch['tickers']
+    print(f"Run {run_id}: {sum(len(batch) for batch in batches)} tickers in {len(batches)} batches")
+
+    started_at = time.time()
+    events = [{'tickers': batch, 'market': market, 'run_id': run_id, 'batch_index': batch_index}
+              for batch_index, batch in enumerate(batches)]
+    with ProcessPoolExecutor(max_workers=concurrency) as executor:
+        worker_runs = sorted(executor.map(run_worker, events))
+    timings['workers'] = time.time() - started_at
+
+    # Same selection as the Map ResultSelector: the first batch answers for all
+    results = [result for _, result, _ in worker_runs]
+    first = results[0] if results and results[0] else {}
+    started_at = time.time()
+    combiner.handler({'market': market, 'date': first.get('date'), 'run_id': run_id}, None)
+    timings['combine'] = time.time() - started_at
+
+    return timings, worker_runs
+
+
+def print_timings(timings, worker_runs):
+    print()
+    print(f"{'stage':<10}{'seconds':>10}")
+    for stage, seconds in timings.items():
+        print(f"{stage:<10}{seconds:>10.1f}")
+    print(f"{'total':<10}{sum(timings.values()):>10.1f}")
+
+    if worker_runs:
+        batch_seconds = [seconds for _, _, seconds in worker_runs]
+        failed = [batch_index for batch_index, result, _ in worker_runs if result is None]
+        print()
+        print(f"batches: {len(worker_runs)}, failed: {failed or 'none'}")
+        print(f"batch seconds: min {min(batch_seconds):.1f}, "
+              f"mean {sum(batch_seconds) / len(batch_seconds):.1f}, max {max(batch_seconds):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the stock snapshot pipeline locally.')
+    parser.add_argument('--market', default='US')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('LOCAL_WORKER_CONCURRENCY', 4)),
+                        help='worker batches run in parallel')
+    parser.add_argument('--data-dir', default=os.getenv('LOCAL_DATA_DIR', '/tmp/nebulight-local'),
+                        help='directory standing in for S3 and the caches')
+    parser.add_argument('--symbols', help='comma separated tickers to use instead of the database universe')
+    parser.add_argument('--calendar', action='store_true',
+                        help='skip the run like the scheduled one when the market had no session')
+    args = parser.parse_args()
+
+    configure_local_environment(args.data_dir)
+    symbols = args.symbols.split(',') if args.symbols else None
+    timings, worker_runs = run_pipeline(args.market, args.concurrency, symbols, force=not args.calendar)
+    print_timings(timings, worker_runs)
+
+
+if __name__ == '__main__':
+    main()
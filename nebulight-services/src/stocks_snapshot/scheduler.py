@@ -2,13 +2,24 @@ import os
 import time
 import boto3
 import json
+from src.object_store import get_data_store
+from src.stocks_snapshot.snapshot import mark_carry_forward
+from src.trading_calendar import run_decision
 
 def handler(event, context):
     client = boto3.client('stepfunctions')
     state_machine_arn = os.getenv('STATE_MACHINE_ARN')
     market = event.get('market', 'US')  # Default to 'US' if not provided
+
+    # Nothing new to fetch on weekends and exchange holidays
+    decision = run_decision(market)
+    if decision['action'] != 'run' and not event.get('force'):
+        print(f"No {market} session on {decision['session_date']}: {decision['action']}")
+        if decision['action'] == 'carry_forward':
+            mark_carry_forward(get_data_store(), market, decision)
+        return decision
     
-    input={ "market": market }
+    input={ "market": market, "force": bool(event.get('force')) }
 
     response = client.start_execution(
         stateMachineArn=state_machine_arn,
@@ -0,0 +1,95 @@
+import json
+import os
+import re
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.instrumentation import span
+from src.metrics.metrics_momentum import momentum_metrics_keys
+
+# Rows per row group; with the file sorted by symbol, a lookup of one symbol
+# only has to read the row group whose min/max statistics bracket it
+SNAPSHOT_ROW_GROUP_SIZE = int(os.getenv('SNAPSHOT_ROW_GROUP_SIZE', 2048))
+SNAPSHOT_COMPRESSION = 'zstd'
+# Low-cardinality strings repeated across rows
+DICTIONARY_COLUMNS = ['symbol', 'sector', 'industry']
+
+
+def _snapshot_schema():
+    fields = [
+        pa.field('symbol', pa.string(), nullable=False),
+        pa.field('Date', pa.timestamp('ms')),
+        pa.field('sector', pa.string()),
+        pa.field('industry', pa.string()),
+    ]
+    fields += [pa.field(column, pa.float64()) for column in ['Open', 'High', 'Low', 'Close']]
+    fields += [pa.field('Volume', pa.int64())]
+    fields += [pa.field(column, pa.float64()) for column in ['Dividends', 'Stock Splits', 'pe_ratio_ttm']]
+    fields += [pa.field(metric, pa.float64()) for metric in momentum_metrics_keys]
+    for metric in momentum_metrics_keys:
+        fields += [pa.field(f'{metric}_rank', pa.float64()), pa.field(f'{metric}_percentile', pa.float64())]
+    for group in ('sector', 'industry'):
+        fields += [pa.field(f'{metric}_{group}_percentile', pa.float64()) for metric in momentum_metrics_keys]
+    return pa.schema(fields)
+
+
+# Every published snapshot has exactly these columns, in this order
+SNAPSHOT_SCHEMA = _snapshot_schema()
+_SNAPSHOT_KEY_PATTERN = re.compile(r'year=(\d+)/month=(\d+)/day=(\d+)/data\.parquet$')
+
+
+def snapshot_key(market, date):
+    return f"market-data/market={market}/year={date.year}/month={date.month}/day={date.day}/data.parquet"
+
+
+def latest_snapshot_key(store, market):
+    """Key of the market's most recent snapshot, None before the first one is written."""
+    dated = []
+    for key in store.list(f"market-data/market={market}/"):
+        match = _SNAPSHOT_KEY_PATTERN.search(key)
+        if match:
+            # Partition values are not zero-padded, so keys do not sort by date
+            dated.append((tuple(int(part) for part in match.groups()), key))
+    return max(dated)[1] if dated else None
+
+
+def read_snapshot(store, key):
+    """The snapshot at key as an Arrow table, None when it does not exist."""
+    body = store.get(key)
+    if body is None:
+        return None
+    with span('snapshot.read', key=key) as read:
+        read.bytes = len(body)
+        return pq.read_table(pa.BufferReader(body))
+
+
+def carry_forward_key(market, session_date):
+    return f"market-calendar/market={market}/{session_date}.json"
+
+
+def mark_carry_forward(store, market, decision):
+    """Records that the snapshot of decision['carry_forward_from'] stands for a day without a session."""
+    store.put(carry_forward_key(market, decision['session_date']), json.dumps(decision).encode('utf-8'))
+
+
+def snapshot_table(df):
+    """Converts the combined frame to the snapshot schema, sorted by symbol. Missing columns are null."""
+    df = df.reindex(columns=SNAPSHOT_SCHEMA.names).sort_values('symbol', kind='stable')
+    if getattr(df['Date'].dtype, 'tz', None) is not None:
+        # Dates are exchange-local trading days
+        df['Date'] = df['Date'].dt.tz_localize(None)
+    return pa.Table.from_pandas(df, schema=SNAPSHOT_SCHEMA, preserve_index=False)
+
+
+def write_snapshot(store, key, df):
+    """Writes a market snapshot laid out for selective reads by Athena or local readers."""
+    table = snapshot_table(df)
+    with span('snapshot.write', key=key, rows=table.num_rows) as write:
+        with store.open_write(key) as stream:
+            with pq.ParquetWriter(stream, SNAPSHOT_SCHEMA,
+                                  compression=SNAPSHOT_COMPRESSION,
+                                  use_dictionary=DICTIONARY_COLUMNS,
+                                  write_statistics=True,
+                                  sorting_columns=[pq.SortingColumn(SNAPSHOT_SCHEMA.get_field_index('symbol'))]) as writer:
+                writer.write_table(table, row_group_size=SNAPSHOT_ROW_GROUP_SIZE)
+            write.bytes = stream.tell()
+    return table
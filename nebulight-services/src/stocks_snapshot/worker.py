@@ -1,66 +1,189 @@
+import math
 import os
-import json
 import time
-import boto3
 import pandas as pd
-import yfinance as yf
-from tempfile import NamedTemporaryFile
-from src.metrics.metrics_momentum import calculate_momentum_metrics
-from src.metrics.metrics_financial_summary import calculate_financial_summary_metrics
+from datetime import datetime, time as clock_time, timedelta
+from src.metrics.metrics_momentum import HISTORY_LOOKBACK_DAYS, benchmark_ticker, load_benchmark_history, momentum_metrics_keys
+from src.metrics.metrics_momentum_panel import build_price_panel, calculate_momentum_panel
+from src.concurrency import map_in_order
+from src.instrumentation import instrumented, span
+from src.metrics.metrics_financial_summary import calculate_financial_summary_metrics_batch
+from src.object_store import get_cache_store, get_data_store, write_parquet
+from src.price_store import download_bars, open_price_store, yahoo_symbol
+from src.rate_limit import ALPHA_VANTAGE, RequestBudget
+from src.stocks_snapshot.batch_planner import record_batch_costs
+from src.stocks_snapshot.intermediate import load_checkpoint, new_run_id, part_key, save_checkpoint
+from src.stocks_snapshot.negative_cache import record_outcomes
+from src.trading_calendar import last_session
 
-def fetch_stock_data(ticker_symbol, market = 'US'):
-    ticker_symbol_formatted = ticker_symbol if market == 'US' else f'{ticker_symbol}.L'
+DAILY_BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+# Tickers processed in parallel; upstream hosts are protected by their own limits
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 8))
+# Results are flushed to S3 and the checkpoint updated after this many tickers
+CHECKPOINT_EVERY = int(os.getenv('CHECKPOINT_EVERY', 25))
+# Part of the 900 s Lambda timeout a batch may spend on Alpha Vantage calls. At
+# 5 requests a minute a cold batch cannot fetch every ticker's earnings, so it
+# fetches what fits and leaves the rest for the next night's run.
+EARNINGS_TIME_BUDGET_SECONDS = int(os.getenv('EARNINGS_TIME_BUDGET_SECONDS', 600))
+# Kept back from the Lambda timeout for the metrics and writes after the price
+# download; until then the download waits for its Yahoo budget rather than fail
+WORKER_FINISH_SECONDS = int(os.getenv('WORKER_FINISH_SECONDS', 180))
+
+def session_end_date(session):
+    """Download end for a session: Yahoo treats end as exclusive, so the day after it."""
+    return datetime.combine(session + timedelta(days=1), clock_time())
+
+def download_max_wait(context):
+    """How long price downloads may wait for Yahoo budget, from the Lambda's remaining time."""
+    if context is None:
+        # Local runs have no timeout to respect
+        return math.inf
+    return max(0.0, context.get_remaining_time_in_millis() / 1000 - WORKER_FINISH_SECONDS)
+
+def fetch_batch_history(tickers, market, price_store=None, end_date=None, max_wait=None):
+    """Loads the OHLCV history of a whole batch with multi-symbol downloads, keyed by ticker."""
+    end_date = end_date or datetime.today()
+    if price_store:
+        # Only fetch the bars missing since the last run, then read everything from the store
+        price_store.update(tickers, end_date, max_wait)
+        return {ticker: price_store.history(ticker) for ticker in tickers}
+
+    start_date = end_date - timedelta(days=HISTORY_LOOKBACK_DAYS)
+    return download_bars(tickers, market, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'),
+                         max_wait=max_wait)
+
+def fetch_stock_data(ticker_symbol, market = 'US', stock_data=None):
     try:
-        ticker = yf.Ticker(ticker_symbol_formatted)
-        df = ticker.history(period='1d')
-        if df.empty:
+        if stock_data is None or stock_data.empty:
             return None
+        # The latest bar is the daily snapshot row
+        df = stock_data.iloc[[-1]].reindex(columns=DAILY_BAR_COLUMNS)
         df['symbol'] = ticker_symbol
-        momentum_metrics = calculate_momentum_metrics(stock_ticker=ticker_symbol)
-        momentum_metrics_df = pd.DataFrame(momentum_metrics, index=df.index)
-        time.sleep(0.5)
-        financial_summary_metrics = calculate_financial_summary_metrics(stock_ticker=ticker_symbol_formatted)
-        financial_summary_df = pd.DataFrame(financial_summary_metrics, index=df.index)
-    
-        df = pd.concat([df, momentum_metrics_df, financial_summary_df], axis=1)
-
         return df
     except Exception as e:
         print(f"Failed to download data for {ticker_symbol}: {e}")
         return None
 
+def calculate_batch_momentum(histories, index_data, end_date):
+    """Momentum metrics of many tickers in one vectorized pass over a tickers x days panel."""
+    panel = build_price_panel(histories)
+    index_close = pd.Series(index_data['Adj Close'].to_numpy(dtype=float),
+                            index=pd.DatetimeIndex(index_data.index).tz_localize(None))
+    index_close = index_close.reindex(pd.DatetimeIndex(panel.dates)).to_numpy()
+    return calculate_momentum_panel(panel, index_close, end_date)
+
+@instrumented('worker')
 def handler(event, context):
-    s3_bucket = os.getenv('S3_DATA_BUCKET')
-    s3_client = boto3.client('s3')
     tickers = event.get('tickers')
     market = event.get('market', 'US')
+    # Identify the batch across retries: execution name and Map item index
+    run_id = event.get('run_id') or new_run_id()
+    batch_index = event.get('batch_index', 0)
+    started_at = time.time()
+
+    checkpoint_store = get_data_store()
+    with span('worker.load_checkpoint') as load:
+        checkpoint = load_checkpoint(checkpoint_store, run_id, batch_index)
+        # Attempts that came before this one, i.e. Step Functions retries of the batch
+        load.retries = checkpoint.get('attempts', 0)
+        checkpoint['attempts'] = load.retries + 1
+    # A retry only fetches what a previous attempt did not finish, failed tickers included
+    done = set(checkpoint['done'])
+    pending = [ticker for ticker in tickers if ticker not in done]
+    if done:
+        print(f"Resuming batch {batch_index}: {len(done)} done, {len(pending)} pending")
     
-    combined_data = []
-    
-    index = 0
-    
-    for ticker in tickers:
-        index = index + 1
-        print(f">>> Symbol {ticker}: {index} out of {len(tickers)}")
-        data = fetch_stock_data(ticker, market)
-        if data is not None:
-            combined_data.append(data)
-        time.sleep(0.5)  # Rate limit compliance
-    
-    if not combined_data:
-        return
-    
-    combined_df = pd.concat(combined_data)
-    current_timestamp_ms = str(time.time())
-    file_key = f"intermediate_results/batch_{current_timestamp_ms}.parquet"
-    
-    with NamedTemporaryFile(delete=False) as temp_file:
-        combined_df.to_parquet(temp_file.name)
-        s3_client.upload_file(temp_file.name, s3_bucket, file_key)
-        os.remove(temp_file.name)
-        
+    # The session that closed last; every published row must be its bar
+    session = last_session(market)
+    end_date = session_end_date(session)
+
+    # Download the benchmark once for the whole batch instead of once per ticker
+    index_data = load_benchmark_history(benchmark_ticker(), end_date)
+
+    # One batched price download for every ticker instead of a request per ticker
+    price_store = open_price_store(market)
+    with span('worker.fetch_history', tickers=len(pending)) as fetch:
+        batch_history = fetch_batch_history(pending, market, price_store, end_date, download_max_wait(context))
+        fetch.fields['found'] = len(batch_history)
+    # Every ticker is charged an equal share of the batched download
+    fetch_share = fetch.seconds / len(pending) if pending else 0.0
+
+    earnings_budget = RequestBudget(ALPHA_VANTAGE, EARNINGS_TIME_BUDGET_SECONDS)
+    ticker_seconds = {}
+    failed = set()
+    # Tickers whose latest bar predates the session, e.g. halted or delisted ones
+    stale = set()
+
+    def process(item):
+        index, ticker = item
+        with span('worker.ticker', ticker=ticker, position=len(done) + index, of=len(tickers)) as work:
+            data = fetch_stock_data(ticker, market, batch_history.get(ticker))
+            if data is not None and data.index[-1].date() != session:
+                print(f"{ticker}: latest bar is from {data.index[-1].date()}, not the {session} session")
+                stale.add(ticker)
+                data = None
+            work.fields['failed'] = data is None
+        ticker_seconds[ticker] = fetch_share + work.seconds
+        return data
+
+    for chunk_start in range(0, len(pending), CHECKPOINT_EVERY):
+        chunk = pending[chunk_start:chunk_start + CHECKPOINT_EVERY]
+        results = map_in_order(process, enumerate(chunk, start=chunk_start + 1), WORKER_CONCURRENCY)
+        combined_data = [data for data in results if data is not None]
+        failed.update(ticker for ticker, data in zip(chunk, results) if data is None and ticker not in stale)
+
+        if combined_data:
+            combined_df = pd.concat(combined_data)
+            symbols = list(combined_df['symbol'])
+
+            with span('metrics.momentum_panel', tickers=len(symbols)) as momentum:
+                momentum_df = calculate_batch_momentum({symbol: batch_history[symbol] for symbol in symbols},
+                                                       index_data, end_date)
+                for column in momentum_metrics_keys:
+                    combined_df[column] = momentum_df[column].reindex(symbols).to_numpy()
+            for symbol in symbols:
+                ticker_seconds[symbol] += momentum.seconds / len(symbols)
+
+            # Financial summary metrics reuse the closing prices loaded above, for the whole chunk at once
+            stock_prices = pd.Series(combined_df['Close'].to_numpy(),
+                                     index=[yahoo_symbol(symbol, market) for symbol in combined_df['symbol']])
+            earnings_seconds = {}
+            financial_summary_df = calculate_financial_summary_metrics_batch(
+                stock_prices, WORKER_CONCURRENCY, earnings_budget, earnings_seconds)
+            # Earnings calls, rate limit waits included, are what sets expensive tickers apart
+            for symbol, price_symbol in zip(combined_df['symbol'], stock_prices.index):
+                ticker_seconds[symbol] += earnings_seconds.get(price_symbol, 0.0)
+            for column in financial_summary_df.columns:
+                combined_df[column] = financial_summary_df[column].to_numpy()
+
+            part_index = len(checkpoint['parts'])
+            file_key = part_key(run_id, batch_index, part_index)
+
+            write_parquet(checkpoint_store, file_key, combined_df)
+
+            checkpoint['parts'].append(file_key)
+            checkpoint['date'] = combined_df.index[0].isoformat()
+
+        # Only tickers whose rows reached S3 count as done; a retry cannot make a stale bar current
+        checkpoint['done'].extend(ticker for ticker, data in zip(chunk, results) if data is not None or ticker in stale)
+        checkpoint['failed'] = sorted(failed)
+        save_checkpoint(checkpoint_store, run_id, batch_index, checkpoint)
+
+    if earnings_budget.remaining == 0:
+        print("Alpha Vantage budget of the batch spent; tickers left without cached earnings have no P/E")
+
+    stats_store = get_cache_store()
+    if stats_store and ticker_seconds:
+        record_batch_costs(stats_store, market, ticker_seconds, failed, time.time() - started_at)
+        # A batch where nothing came back points at an upstream outage, not at its tickers.
+        # Stale tickers count as failed too: stored bars must not keep a delisted one alive.
+        unavailable = failed | stale
+        if len(unavailable) < len(ticker_seconds):
+            record_outcomes(stats_store, market, set(ticker_seconds) - unavailable, unavailable)
+
+    # Always answer, even for an empty batch, so the Map result can feed the combiner
     return {
         'market': market,
-        'date': combined_df.index[0].isoformat()
+        'run_id': run_id,
+        'date': checkpoint['date']
     }
-
@@ -0,0 +1,230 @@
+"""
+Prebuilt symbol search index, memory-mapped by the API.
+
+Built by src/scripts/build_symbol_index.py from the reference-data CSVs and the
+nebulight_tickers table. Searching it needs no upstream call: tickers match by
+prefix, ISINs exactly, and names by shared trigrams, which tolerates typos.
+
+File layout, little endian: the magic, version, record count and section count,
+then an (offset, length) pair per section of SECTIONS. Sections are numpy
+arrays, 8-byte aligned, read in place from the mapping.
+"""
+import mmap
+import os
+import re
+import struct
+import unicodedata
+import numpy as np
+
+REFERENCE_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reference-data')
+SYMBOL_INDEX_PATH = os.getenv('SYMBOL_INDEX_PATH', os.path.join(REFERENCE_DATA_DIR, 'symbol_index.bin'))
+
+MAGIC = b'NBSI'
+VERSION = 1
+FIELDS = ('ticker', 'name', 'exchange', 'type', 'isin', 'sector', 'industry')
+SECTIONS = {
+    # UTF-8 text of every distinct field value, and where each one starts
+    'strings': np.uint8,
+    'string_offsets': np.uint32,
+    # String ids of each record's FIELDS, records in rank order
+    'records': np.uint32,
+    'record_trigrams': np.uint16,
+    # Sorted trigram keys and the records of each one, as CSR postings
+    'trigram_keys': np.uint32,
+    'trigram_offsets': np.uint32,
+    'trigram_rows': np.uint32,
+    'ticker_keys': 'S12',
+    'ticker_rows': np.uint32,
+    'isin_keys': 'S12',
+    'isin_rows': np.uint32,
+}
+_HEADER = struct.Struct('<4sIII')
+_SECTION = struct.Struct('<QQ')
+
+# Share of the query's trigrams a name must contain to match
+MIN_SIMILARITY = float(os.getenv('SYMBOL_INDEX_MIN_SIMILARITY', 0.5))
+# Listing boilerplate that would make every name look alike
+STOPWORDS = {'common', 'stock', 'ordinary', 'shares', 'share', 'inc', 'plc', 'ltd', 'limited',
+             'corporation', 'corp', 'class', 'the', 'ord', 'depositary', 'ads'}
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+ISIN_PATTERN = re.compile(r'^[A-Z]{2}[A-Z0-9]{9}[0-9]$')
+
+
+def search_tokens(text):
+    """Lowercase ASCII words of text, accents folded."""
+    folded = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return _TOKEN_PATTERN.findall(folded.lower())
+
+
+def trigrams(tokens):
+    """Trigram keys of the words, each padded so that word starts and ends weigh in."""
+    keys = set()
+    for token in tokens:
+        padded = f'  {token} '.encode('ascii')
+        for i in range(len(padded) - 2):
+            keys.add(padded[i] << 16 | padded[i + 1] << 8 | padded[i + 2])
+    return keys
+
+
+def record_trigrams(record):
+    return trigrams([word for word in search_tokens(record['name']) if word not in STOPWORDS]
+                    + search_tokens(record['ticker']))
+
+
+def write_symbol_index(path, records):
+    """
+    Writes records (dicts with FIELDS, missing ones empty) in the order given,
+    which is the order equally good matches are returned in.
+    """
+    strings = {'': 0}
+    record_ids = np.array([[strings.setdefault(record.get(field) or '', len(strings)) for field in FIELDS]
+                           for record in records], dtype=np.uint32).reshape(-1, len(FIELDS))
+    encoded = [value.encode('utf-8') for value in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    string_offsets[1:] = np.cumsum([len(value) for value in encoded])
+
+    postings = {}
+    counts = np.zeros(len(records), dtype=np.uint16)
+    for row, record in enumerate(records):
+        keys = record_trigrams(record)
+        counts[row] = len(keys)
+        for key in keys:
+            postings.setdefault(key, []).append(row)
+    trigram_keys = np.array(sorted(postings), dtype=np.uint32)
+    trigram_rows = [postings[key] for key in trigram_keys.tolist()]
+    trigram_offsets = np.zeros(len(trigram_keys) + 1, dtype=np.uint32)
+    trigram_offsets[1:] = np.cumsum([len(rows) for rows in trigram_rows])
+
+    tickers = [(record['ticker'].upper().encode('utf-8'), row) for row, record in enumerate(records)]
+    isins = [(record['isin'].upper().encode('ascii'), row)
+             for row, record in enumerate(records) if record.get('isin')]
+    tickers.sort()
+    isins.sort()
+
+    sections = {
+        'strings': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        'string_offsets': string_offsets,
+        'records': record_ids,
+        'record_trigrams': counts,
+        'trigram_keys': trigram_keys,
+        'trigram_offsets': trigram_offsets,
+        'trigram_rows': np.array([row for rows in trigram_rows for row in rows], dtype=np.uint32),
+        'ticker_keys': np.array([key for key, _ in tickers], dtype='S12'),
+        'ticker_rows': np.array([row for _, row in tickers], dtype=np.uint32),
+        'isin_keys': np.array([key for key, _ in isins], dtype='S12'),
+        'isin_rows': np.array([row for _, row in isins], dtype=np.uint32),
+    }
+
+    offset = _HEADER.size + _SECTION.size * len(SECTIONS)
+    table, blobs = [], []
+    for name in SECTIONS:
+        blob = sections[name].astype(SECTIONS[name]).tobytes()
+        padding = -offset % 8
+        blobs.append(b'\0' * padding + blob)
+        offset += padding
+        table.append(_SECTION.pack(offset, len(blob)))
+        offset += len(blob)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(records), len(SECTIONS)))
+        f.write(b''.join(table))
+        f.write(b''.join(blobs))
+    os.replace(tmp_path, path)
+    return offset
+
+
+class SymbolIndexFile:
+    """Read-only view of a symbol index file; arrays point into the mapping, nothing is copied."""
+
+    def __init__(self, buffer):
+        magic, version, count, section_count = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION or section_count != len(SECTIONS):
+            raise ValueError(f"Not a version {VERSION} symbol index")
+        self.buffer = buffer
+        self.count = count
+        for i, (name, dtype) in enumerate(SECTIONS.items()):
+            offset, length = _SECTION.unpack_from(buffer, _HEADER.size + _SECTION.size * i)
+            itemsize = np.dtype(dtype).itemsize
+            setattr(self, name, np.frombuffer(buffer, dtype=dtype, count=length // itemsize, offset=offset))
+        self.records = self.records.reshape(count, len(FIELDS))
+
+    def __len__(self):
+        return self.count
+
+    def records_at(self, rows):
+        """Decodes the records of rows, looking up all their strings at once."""
+        string_ids = self.records[np.asarray(rows, dtype=np.intp)]
+        starts = self.string_offsets[string_ids].tolist()
+        ends = self.string_offsets[string_ids + 1].tolist()
+        strings = self.strings.data
+        return [{field: bytes(strings[start:end]).decode('utf-8')
+                 for field, start, end in zip(FIELDS, row_starts, row_ends)}
+                for row_starts, row_ends in zip(starts, ends)]
+
+    @staticmethod
+    def _key_range(keys, key, prefix):
+        start = np.searchsorted(keys, key, side='left')
+        end = np.searchsorted(keys, key + b'\xff' if prefix else key, side='right')
+        return start, end
+
+    def _fuzzy_rows(self, query):
+        """Rows whose name shares enough of the query's trigrams, most similar first."""
+        keys = np.fromiter(trigrams(search_tokens(query)), dtype=np.uint32)
+        if not len(keys) or not len(self.trigram_keys):
+            return np.empty(0, dtype=np.uint32)
+        positions = np.minimum(np.searchsorted(self.trigram_keys, keys), len(self.trigram_keys) - 1)
+        positions = positions[self.trigram_keys[positions] == keys]
+        if not len(positions):
+            return np.empty(0, dtype=np.uint32)
+        postings = np.concatenate([self.trigram_rows[self.trigram_offsets[i]:self.trigram_offsets[i + 1]]
+                                   for i in positions])
+        shared = np.bincount(postings, minlength=self.count)
+        rows = np.flatnonzero(shared >= max(1, np.ceil(MIN_SIMILARITY * len(keys))))
+        shared = shared[rows]
+        containment = shared / len(keys)
+        jaccard = shared / (len(keys) + self.record_trigrams[rows] - shared)
+        return rows[np.lexsort((rows, -jaccard, -containment))]
+
+    def search(self, query, limit=20, offset=0):
+        """
+        Records matching query, best first: the ISIN, then ticker prefixes
+        (shortest first, so an exact ticker leads), then names by trigram similarity.
+        """
+        query = query.strip()
+        wanted = offset + limit
+        if not query or limit <= 0:
+            return []
+        key = query.upper().encode('utf-8', 'ignore')
+
+        results = []
+        if ISIN_PATTERN.match(query.upper()):
+            start, end = self._key_range(self.isin_keys, key, prefix=False)
+            results += self.isin_rows[start:end].tolist()
+        if len(key) <= 12:
+            start, end = self._key_range(self.ticker_keys, key, prefix=True)
+            rows = self.ticker_rows[start:end]
+            lengths = np.char.str_len(self.ticker_keys[start:end])
+            results += rows[np.lexsort((rows, lengths))][:wanted].tolist()
+        if len(results) < wanted:
+            seen = set(results)
+            for row in self._fuzzy_rows(query).tolist():
+                if row not in seen:
+                    results.append(row)
+                    if len(results) >= wanted:
+                        break
+
+        return self.records_at(list(dict.fromkeys(results))[offset:wanted])
+
+
+def load_symbol_index(path=None):
+    """Memory-maps the index file, None when it has not been built."""
+    path = path or SYMBOL_INDEX_PATH
+    try:
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"No symbol index at {path}: {e}")
+        return None
+    return SymbolIndexFile(buffer)
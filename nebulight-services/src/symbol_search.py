@@ -1,29 +1,56 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 import requests
+import csv
+import heapq
+import io
 import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from .rate_limit import ALPHA_VANTAGE, acquire
+from .symbol_index import load_symbol_index
 
 ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
+# Listings change at most daily, so each process downloads LISTING_STATUS about once a day
+SYMBOL_INDEX_TTL_SECONDS = int(os.getenv('SYMBOL_INDEX_TTL_SECONDS', 24 * 60 * 60))
+# After a failed refresh the previous index is served and the download retried this much later
+SYMBOL_INDEX_RETRY_SECONDS = 300
+# LISTING_STATUS is a few MB of CSV; a hung download must not pin the refresh
+SYMBOL_INDEX_DOWNLOAD_TIMEOUT = 60
 router = APIRouter()
 
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+_index = {'index': None, 'loaded_at': 0.0, 'refreshing': False}
+_index_lock = threading.Lock()
+# Prebuilt by src/scripts/build_symbol_index.py; without it searches fall back to LISTING_STATUS
+_offline_index = load_symbol_index()
+
 
 class SymbolSearchResponse(BaseModel):
     ticker: str
     name: str
     exchange: str
     type: str
+    isin: Optional[str] = None
+    sector: Optional[str] = None
+    industry: Optional[str] = None
 
 
 def fetch_symbols():
     url = f'https://www.alphavantage.co/query?function=LISTING_STATUS&apikey={ALPHA_VANTAGE_API_KEY}'
-    response = requests.get(url)
+    acquire(ALPHA_VANTAGE)
+    response = requests.get(url, timeout=SYMBOL_INDEX_DOWNLOAD_TIMEOUT)
     response.raise_for_status()
-    # Parse the CSV response
-    lines = response.text.splitlines()
+    # Parse the CSV response; company names may contain quoted commas
+    rows = csv.reader(io.StringIO(response.text))
+    next(rows, None)  # Skip header
     symbols = []
-    for line in lines[1:]:  # Skip header
-        fields = line.split(',')
+    for fields in rows:
+        if len(fields) < 4:
+            continue
         symbols.append({
             "ticker": fields[0],
             "name": fields[1],
@@ -33,18 +60,119 @@ def fetch_symbols():
     return symbols
 
 
+def name_tokens(text):
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def _prefix_range(keys, prefix):
+    """Slice bounds of the sorted keys starting with prefix."""
+    return bisect_left(keys, prefix), bisect_left(keys, prefix + '\uffff')
+
+
+class SymbolIndex:
+    """
+    Listings ordered by rank (shorter tickers first, then alphabetically), with a
+    sorted ticker list for prefix lookups and a name token -> rows mapping.
+
+    Rows are positions in that order, so the best matches of any candidate set
+    are simply its smallest rows.
+    """
+
+    def __init__(self, symbols):
+        self.symbols = sorted(symbols, key=lambda symbol: (len(symbol['ticker']), symbol['ticker']))
+        self.ticker_rows = sorted(range(len(self.symbols)), key=lambda row: self.symbols[row]['ticker'].upper())
+        self.tickers = [self.symbols[row]['ticker'].upper() for row in self.ticker_rows]
+        self.rows_by_token = {}
+        for row, symbol in enumerate(self.symbols):
+            for token in set(name_tokens(symbol['name'])):
+                self.rows_by_token.setdefault(token, []).append(row)
+        self.tokens = sorted(self.rows_by_token)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def _token_prefix_rows(self, token):
+        start, end = _prefix_range(self.tokens, token)
+        rows = set()
+        for key in self.tokens[start:end]:
+            rows.update(self.rows_by_token[key])
+        return rows
+
+    def search(self, query, limit=20, offset=0):
+        """
+        Listings matching query, best first:
+        ticker prefix (an exact ticker is the shortest, so it comes first), then
+        names containing every query word, then names with words starting with
+        every query word.
+        """
+        query = query.strip()
+        wanted = offset + limit
+        if not query or limit <= 0:
+            return []
+
+        start, end = _prefix_range(self.tickers, query.upper())
+        results = heapq.nsmallest(wanted, self.ticker_rows[start:end])
+
+        tokens = name_tokens(query)
+        if tokens and len(results) < wanted:
+            seen = set(results)
+            exact = set.intersection(*(set(self.rows_by_token.get(token, ())) for token in tokens))
+            results += heapq.nsmallest(wanted - len(results), exact - seen)
+        if tokens and len(results) < wanted:
+            seen = set(results)
+            prefixed = set.intersection(*(self._token_prefix_rows(token) for token in tokens))
+            results += heapq.nsmallest(wanted - len(results), prefixed - seen)
+
+        return [self.symbols[row] for row in results[offset:wanted]]
+
+
+def _load_symbol_index():
+    _index['index'] = SymbolIndex(fetch_symbols())
+    _index['loaded_at'] = time.time()
+    print(f"Loaded symbol index with {len(_index['index'])} listings")
+
+
+def _refresh_symbol_index():
+    try:
+        _load_symbol_index()
+    except Exception as e:
+        print(f"Refreshing the symbol index failed, serving the previous one: {e}")
+        _index['loaded_at'] = time.time() - SYMBOL_INDEX_TTL_SECONDS + SYMBOL_INDEX_RETRY_SECONDS
+    finally:
+        _index['refreshing'] = False
+
+
+def get_symbol_index():
+    """
+    The index of this process, rebuilt from LISTING_STATUS once it is older than
+    the TTL. Searches keep using the previous index while a background thread
+    rebuilds it; only the very first search waits for a download.
+    """
+    index = _index['index']
+    if index is not None:
+        if time.time() - _index['loaded_at'] >= SYMBOL_INDEX_TTL_SECONDS:
+            with _index_lock:
+                if not _index['refreshing']:
+                    _index['refreshing'] = True
+                    threading.Thread(target=_refresh_symbol_index, daemon=True).start()
+        return index
+    with _index_lock:
+        if _index['index'] is None:
+            _load_symbol_index()
+        return _index['index']
+
+
 @router.get("/search-symbols/", response_model=List[SymbolSearchResponse])
-async def search_symbols(query: str):
+def search_symbols(query: str, limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0)):
     try:
-        symbols = fetch_symbols()
+        index = _offline_index or get_symbol_index()
     except Exception as e:
         raise HTTPException(
             status_code=500, detail="An error occurred while fetching symbols data")
 
-    matching_symbols = [symbol for symbol in symbols if query.lower(
-    ) in symbol["ticker"].lower() or query.lower() in symbol["name"].lower()]
+    matching_symbols = index.search(query, limit=limit, offset=offset)
 
-    if not matching_symbols:
+    if not matching_symbols and offset == 0:
         raise HTTPException(
             status_code=404, detail="No matching symbols found")
 
@@ -0,0 +1,162 @@
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from dateutil.easter import easter
+
+# What a run on a day without a session does: 'skip' it entirely, or
+# 'carry_forward' to record that the previous session's snapshot stands for the day
+NON_TRADING_DAY_MODE = os.getenv('NON_TRADING_DAY_MODE', 'skip')
+
+# Exchange timezone and regular close per market
+MARKET_SESSIONS = {
+    'US': (ZoneInfo('America/New_York'), time(16, 0)),
+    'UK': (ZoneInfo('Europe/London'), time(16, 30)),
+}
+
+# Closures no rule predicts: national days of mourning and one-off bank holidays
+SPECIAL_CLOSURES = {
+    'US': {date(2018, 12, 5), date(2025, 1, 9)},
+    'UK': {date(2022, 9, 19), date(2023, 5, 8)},
+}
+# Bank holidays moved away from their usual date that year
+MOVED_HOLIDAYS = {
+    'UK': {
+        # Early May bank holiday moved to VE Day
+        date(2020, 5, 4): date(2020, 5, 8),
+        # Spring bank holiday moved for the Platinum Jubilee, with an extra day after it
+        date(2022, 5, 30): date(2022, 6, 2),
+    },
+}
+EXTRA_HOLIDAYS = {
+    'UK': {date(2022, 6, 3)},
+}
+
+
+def _nth_weekday(year, month, weekday, n):
+    """n-th given weekday (Monday is 0) of the month, n=-1 for the last one."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year, month + 1, 1) - timedelta(days=1) if month < 12 else date(year, 12, 31)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed_nearest(day):
+    """US rule: a Saturday holiday is observed on Friday, a Sunday one on Monday."""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def nyse_holidays(year):
+    holidays = set()
+    new_year = date(year, 1, 1)
+    # NYSE does not close on a Friday December 31 for a Saturday New Year's Day
+    if new_year.weekday() != 5:
+        holidays.add(_observed_nearest(new_year))
+    holidays.add(_nth_weekday(year, 1, 0, 3))  # Martin Luther King Jr. Day
+    holidays.add(_nth_weekday(year, 2, 0, 3))  # Washington's Birthday
+    holidays.add(easter(year) - timedelta(days=2))  # Good Friday
+    holidays.add(_nth_weekday(year, 5, 0, -1))  # Memorial Day
+    if year >= 2022:
+        holidays.add(_observed_nearest(date(year, 6, 19)))  # Juneteenth
+    holidays.add(_observed_nearest(date(year, 7, 4)))
+    holidays.add(_nth_weekday(year, 9, 0, 1))  # Labor Day
+    holidays.add(_nth_weekday(year, 11, 3, 4))  # Thanksgiving
+    holidays.add(_observed_nearest(date(year, 12, 25)))
+    return holidays
+
+
+def lse_holidays(year):
+    holidays = set()
+    new_year = date(year, 1, 1)
+    # UK substitute days fall on the following weekdays
+    holidays.add(new_year + timedelta(days={5: 2, 6: 1}.get(new_year.weekday(), 0)))
+    holidays.add(easter(year) - timedelta(days=2))  # Good Friday
+    holidays.add(easter(year) + timedelta(days=1))  # Easter Monday
+    holidays.add(_nth_weekday(year, 5, 0, 1))  # Early May bank holiday
+    holidays.add(_nth_weekday(year, 5, 0, -1))  # Spring bank holiday
+    holidays.add(_nth_weekday(year, 8, 0, -1))  # Summer bank holiday
+    christmas = date(year, 12, 25)
+    if christmas.weekday() == 5:
+        holidays.update({christmas + timedelta(days=2), christmas + timedelta(days=3)})
+    elif christmas.weekday() == 6:
+        holidays.update({christmas + timedelta(days=1), christmas + timedelta(days=2)})
+    elif christmas.weekday() == 4:
+        holidays.update({christmas, christmas + timedelta(days=3)})
+    else:
+        holidays.update({christmas, christmas + timedelta(days=1)})
+    return holidays
+
+
+@lru_cache(maxsize=None)
+def holidays(market, year):
+    """Weekday closures of the market's exchange in year."""
+    rules = nyse_holidays if market == 'US' else lse_holidays
+    moved = MOVED_HOLIDAYS.get(market, {})
+    days = {moved.get(day, day) for day in rules(year)}
+    days |= EXTRA_HOLIDAYS.get(market, set()) | SPECIAL_CLOSURES.get(market, set())
+    return frozenset(day for day in days if day.year == year)
+
+
+def is_trading_day(market, day):
+    return day.weekday() < 5 and day not in holidays(market, day.year)
+
+
+def previous_trading_day(market, day):
+    day -= timedelta(days=1)
+    while not is_trading_day(market, day):
+        day -= timedelta(days=1)
+    return day
+
+
+def next_trading_day(market, day):
+    day += timedelta(days=1)
+    while not is_trading_day(market, day):
+        day += timedelta(days=1)
+    return day
+
+
+def next_close(market, now=None):
+    """The first regular close of the market after now, as an aware datetime."""
+    zone, close = MARKET_SESSIONS[market]
+    local = (now or datetime.now(timezone.utc)).astimezone(zone)
+    day = local.date()
+    if local.time() >= close or not is_trading_day(market, day):
+        day = next_trading_day(market, day)
+    return datetime.combine(day, close, tzinfo=zone)
+
+
+def session_date(market, now=None):
+    """
+    The exchange-local day a run started at now is about: today once the
+    market has closed, otherwise yesterday.
+    """
+    zone, close = MARKET_SESSIONS[market]
+    local = (now or datetime.now(timezone.utc)).astimezone(zone)
+    return local.date() if local.time() >= close else local.date() - timedelta(days=1)
+
+
+def last_session(market, now=None):
+    """The most recent session that has closed by now."""
+    day = session_date(market, now)
+    return day if is_trading_day(market, day) else previous_trading_day(market, day)
+
+
+def run_decision(market, now=None, mode=None):
+    """
+    Decides what a snapshot run started at now should do, without any upstream call.
+
+    :return: dict with the session_date and an action of 'run', 'skip' or
+        'carry_forward'; a carry forward also names the session it carries.
+    """
+    day = session_date(market, now)
+    if is_trading_day(market, day):
+        return {'session_date': day.isoformat(), 'action': 'run'}
+    if (mode or NON_TRADING_DAY_MODE) == 'carry_forward':
+        return {'session_date': day.isoformat(), 'action': 'carry_forward',
+                'carry_forward_from': previous_trading_day(market, day).isoformat()}
+    return {'session_date': day.isoformat(), 'action': 'skip'}